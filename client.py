@@ -1,18 +1,159 @@
+import asyncio
+import queue
 import random
 import threading
-from typing import Any, List
+import time
+from collections import deque
+from typing import Any, Dict, List
 
-from labrpc.labrpc import ClientEnd
-from server import GetArgs, GetReply, PutAppendArgs, PutAppendReply
+from labrpc.labrpc import ClientEnd, REAL_CLOCK
+from partitioner import StaticPartitioner
+from server import GetArgs, GetReply, PutAppendArgs, PutAppendReply, MultiGetArgs, MultiPutAppendArgs
+
+# how long to keep sending to a backup before trying the primary first again
+PRIMARY_RETRY_INTERVAL = 1.0 # seconds
+
+# longest a hedged get call may run when the retry policy has no deadline
+# (a bit more than the worst labrpc delay), so abandoned calls always end
+HEDGE_TIMEOUT = 10.0 # seconds
+
+class ClerkTimeoutError(TimeoutError):
+    # raised when a retry policy gives up on an operation
+    # note that a Put/Append that timed out may or may not have been applied
+    pass
+
+class RetryPolicy:
+    # how Clerk retries when no server in a replica group answers
+    # - after every full round over the group it sleeps for a random time
+    #   between 0 and min(max_backoff, base_backoff * 2^round) (full jitter),
+    #   so clients that failed together don't all retry together
+    # - max_attempts limits the number of RPCs per operation
+    # - deadline limits the time per operation in seconds
+    # None means no limit, which is the old "keep trying forever" behavior
+    def __init__(self, base_backoff: float = 0.005, max_backoff: float = 0.1,
+                 max_attempts: int = None, deadline: float = None):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+
+    def backoff(self, rounds: int, rand=random) -> float:
+        cap = min(self.max_backoff, self.base_backoff * (2 ** min(rounds, 32)))
+        return rand.uniform(0, cap)
+
+class ClerkStats:
+    # counters for how much retrying a clerk does
+    # ops: operations (one per RPC batch), rpcs: calls made, retries: calls
+    # after the first one of an operation (hedges included), timeouts:
+    # operations given up on,
+    # backoff_time: seconds spent sleeping between rounds, hedges: hedged
+    # gets that were sent to a second replica
+    def __init__(self):
+        self.mu = threading.Lock()
+        self.counters = {"ops": 0, "rpcs": 0, "retries": 0, "timeouts": 0, "backoff_time": 0.0, "hedges": 0}
+
+    def count(self, name: str, n=1):
+        with self.mu:
+            self.counters[name] += n
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.mu:
+            return dict(self.counters)
+
+class Attempts:
+    # retry bookkeeping for one operation, shared by Clerk and AsyncClerk
+    # clock and rand come from the network, so deadlines and backoffs follow
+    # simulated time when the network is simulated
+    def __init__(self, policy: RetryPolicy, stats: ClerkStats, svcMeth: str, clock=REAL_CLOCK, rand=random):
+        self.policy = policy
+        self.stats = stats
+        self.svcMeth = svcMeth
+        self.clock = clock
+        self.rand = rand
+        self.attempts = 0
+        self.rounds = 0
+        self.deadline = None
+        if policy.deadline is not None:
+            self.deadline = clock.now() + policy.deadline
+        stats.count("ops")
+
+    def next(self):
+        # called before every call, gives up if the policy says so
+        # (a call that is already sent is cut off by its timeout, see remaining)
+        policy = self.policy
+        if policy.max_attempts is not None and self.attempts >= policy.max_attempts:
+            self.stats.count("timeouts")
+            raise ClerkTimeoutError(f"{self.svcMeth}: no reply after {self.attempts} attempts")
+        if self.deadline is not None and self.clock.now() >= self.deadline:
+            self.stats.count("timeouts")
+            raise ClerkTimeoutError(f"{self.svcMeth}: no reply within {policy.deadline}s")
+
+        self.attempts += 1
+        self.stats.count("rpcs")
+        if self.attempts > 1:
+            self.stats.count("retries")
+
+    def remaining(self):
+        # seconds left before the deadline, used as the timeout of each
+        # call so one slow call can't run past it (None: no deadline)
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self.clock.now())
+
+    def backoff(self) -> float:
+        # how long to sleep after a round where every server failed
+        delay = self.policy.backoff(self.rounds, self.rand)
+        self.rounds += 1
+        if self.deadline is not None:
+            delay = min(delay, max(0.0, self.deadline - self.clock.now()))
+        if delay > 0:
+            self.stats.count("backoff_time", delay)
+        return delay
+
+def valid_reply(reply) -> bool:
+    return reply is not None and getattr(reply, "err", "") != "WRONG_SHARD"
+
+class LatencyTracker:
+    # rolling window of recent RPC latencies, used to pick when to hedge
+    def __init__(self, window: int = 200, default: float = 0.03):
+        self.mu = threading.Lock()
+        self.samples = deque(maxlen=window)
+        self.default = default # used until there are enough samples
+
+    def record(self, seconds: float):
+        with self.mu:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        with self.mu:
+            if len(self.samples) < 20:
+                return self.default
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
 
 def nrand() -> int:
     return random.getrandbits(62)
 
 class Clerk:
-    def __init__(self, servers: List[ClientEnd], cfg):
+    def __init__(self, servers: List[ClientEnd], cfg, retry: RetryPolicy = None, hedge: bool = None):
         self.servers = servers
         self.cfg = cfg
 
+        # hedged reads: if a Get hasn't been answered after the p95 latency,
+        # send it to a second replica as well and use whichever answers first
+        self.hedge = hedge if hedge is not None else getattr(cfg, "hedged_reads", False)
+        self.latency = LatencyTracker()
+
+        # retry behavior, from the config unless given
+        self.retry = retry or getattr(cfg, "retry_policy", None) or RetryPolicy()
+        self.stats = ClerkStats()
+
+        # time and randomness of the network, simulated time and a seeded RNG
+        # if the network is a simulation (see labrpc.Simulator)
+        net = getattr(cfg, "net", None)
+        self.clock = getattr(net, "clock", REAL_CLOCK)
+        self.rand = getattr(net, "rand", random)
+
         # unique client id is generated
         self.client_id =nrand() # use the nrand that is in this file
 
@@ -20,103 +161,250 @@ class Clerk:
         # prof said to differentiate repeated messages
         self.request_id= 0
 
+        # request ids that were sent but have not gotten a reply yet
+        # the lowest one is sent along as the ack so servers can forget the rest
+        self.outstanding = set()
+
+        # key -> shard mapping, shared with the servers through the config
+        self.partitioner = getattr(cfg, "partitioner", None) or StaticPartitioner()
+
+        # shard -> replica group, see replicaServersFor
+        self.groups = {}
+        self.groups_nreplicas = None
+
+        # shard -> (position in the replica group, time) of the backup that
+        # last answered when the primary didn't, see first_server
+        self.last_good = {}
+
         # need the lock in case of concurrent client threads
         self.lock = threading.Lock()
 
 
     # added Definiton for Task : Static Sharding and Replication ---------------------
-    def getReplicaServers(self, key:str) -> List[ClientEnd]:
+    def shard_for(self, key: str) -> int:
         # prof mentioned we should use static partitioning
         # this implementation follows amazon dynamo
-        # static paritioning: int(key) % n-shards
-        nreplicas = getattr(self.cfg,'nreplicas', 1)
-        try:
-            key_int= int(key) # convert key to integer
-        except ValueError:
-            # set to 0 if key isn't numeric
-            key_int = 0
+        # static paritioning by default: int(key) % n-shards
+        # same partitioner as the servers (see partitioner.py)
+        return self.partitioner.shard(key, len(self.servers))
 
-        # determine
-        nshards = len(self.servers)
-        shard = key_int%nshards
+    def replicaServersFor(self, shard: int) -> List[ClientEnd]:
+        # return replica group, the primary comes first
+        # groups are built once per shard and reused (rebuilt if nreplicas changes)
+        nreplicas = getattr(self.cfg,'nreplicas', 1)
+        if nreplicas != self.groups_nreplicas:
+            self.groups = {}
+            self.groups_nreplicas = nreplicas
 
-        # return replica group
-        replicaGroup = []
-        for i in range(0, nreplicas):
+        replicaGroup = self.groups.get(shard)
+        if replicaGroup is None:
+            nshards = len(self.servers)
+            replicaGroup = []
+            for i in range(0, nreplicas):
 
-            serverIndex = (shard +i) % nshards
-            replicaGroup.append(self.servers[ serverIndex ])
+                serverIndex = (shard +i) % nshards
+                replicaGroup.append(self.servers[ serverIndex ])
+            self.groups[shard] = replicaGroup
 
         return replicaGroup
 
+    def getReplicaServers(self, key:str) -> List[ClientEnd]:
+        return self.replicaServersFor(self.shard_for(key))
 
-    # BASE CODE ----------------------------------------------------------------------
-    
-    def get(self, key: str) -> str:
-        # Fetch the current value for a key.
-        # Returns "" if the key does not exist.
-        # Keeps trying forever in the face of all other errors.
-        
+    def first_server(self, shard: int) -> int:
+        # position in the replica group to try first
+        # normally the primary, so requests don't take the extra forward hop
+        # through a backup. after the primary failed we stick with the backup
+        # that answered, but only for a while so we go back to the primary
+        # once it is reachable again
+        with self.lock:
+            entry = self.last_good.get(shard)
+            if entry is None:
+                return 0
+            pos, when = entry
+            if self.clock.now() - when > PRIMARY_RETRY_INTERVAL:
+                del self.last_good[shard]
+                return 0
+            return pos
 
-        args = GetArgs(key)
-        replicaGroup = self.getReplicaServers(key)
+    def remember_server(self, shard: int, pos: int):
+        with self.lock:
+            if pos == 0:
+                self.last_good.pop(shard, None)
+            elif shard not in self.last_good or self.last_good[shard][0] != pos:
+                self.last_good[shard] = (pos, self.clock.now())
+
+    def call_group(self, shard: int, svcMeth: str, args: Any, attempts: Attempts = None) -> Any:
+        replicaGroup = self.replicaServersFor(shard)
+        pos = self.first_server(shard)
+        if attempts is None:
+            attempts = Attempts(self.retry, self.stats, svcMeth, self.clock, self.rand)
         ## This retry loop keeps trying until a server works 
         # essentially handles unreliable networks
         while True:
-            for server in replicaGroup:
+            for _ in range(len(replicaGroup)):
+                # raises ClerkTimeoutError if the policy says to give up
+                attempts.next()
+
                 # for every server inside replica group try to get a reply
+                # starting with the one that worked last time
+                server = replicaGroup[pos]
                 try:
-                    reply = server.call("KVServer.Get", args)
+                    reply = server.call(svcMeth, args, attempts.remaining())
 
                     # only accept valid responses
-                    if reply is None:
-                        continue
+                    # skip if server is not the right shard
+                    if valid_reply(reply):
+                        self.remember_server(shard, pos)
+                        return reply
+                except Exception:
+                    pass
+                # timeout or wrong shard, move on to the next one
+                pos = (pos + 1) % len(replicaGroup)
 
-                    if getattr(reply, "err", "") == "WRONG_SHARD":
-                        continue
+            # every server in the group failed, wait a bit before the next
+            # round instead of hammering servers that are probably down
+            delay = attempts.backoff()
+            if delay > 0:
+                self.clock.sleep(delay)
 
-                    # if no error then
-                    # return the value
-                    return reply.value
-                except Exception:
-                    continue
+    def try_call(self, server: ClientEnd, svcMeth: str, args: Any, timeout: float) -> Any:
+        # one call, returns None instead of an invalid reply
+        start = time.monotonic()
+        try:
+            reply = server.call(svcMeth, args, timeout)
+        except Exception:
+            return None
+        if not valid_reply(reply):
+            return None
+        self.latency.record(time.monotonic() - start)
+        return reply
 
+    def hedged_call(self, shard: int, svcMeth: str, args: Any, attempts: Attempts) -> Any:
+        # send to the usual first server, and if it hasn't answered within
+        # the p95 latency (or failed) also send to the next one
+        # returns the first valid reply, or None if both failed (the caller
+        # then falls back to call_group with the same attempts). the slower
+        # call is abandoned, its reply is ignored when it shows up
+        # every call counts against the retry policy and has a timeout, so
+        # an abandoned call can't outlive the deadline (or HEDGE_TIMEOUT).
+        # the calls run on daemon threads, which never keep the process
+        # from exiting
+        replicaGroup = self.replicaServersFor(shard)
+        pos = self.first_server(shard)
+        threshold = self.latency.percentile(0.95)
+        results = queue.SimpleQueue()
 
-    # Shared by Put and Append.
-    def put_append(self, key: str, value: str, op: str) -> str:
-        # assigning a unique id
+        def start(p):
+            attempts.next()
+            remaining = attempts.remaining()
+            timeout = HEDGE_TIMEOUT if remaining is None else min(remaining, HEDGE_TIMEOUT)
+            threading.Thread(target=lambda: results.put((p, self.try_call(replicaGroup[p], svcMeth, args, timeout))),
+                             daemon=True).start()
+
+        start(pos)
+        pending = 1
+        hedged = False
+        while pending:
+            try:
+                p, reply = results.get(timeout=None if hedged else threshold)
+            except queue.Empty:
+                p, reply = None, None
+            else:
+                pending -= 1
+                if reply is not None:
+                    self.remember_server(shard, p)
+                    return reply
+            if not hedged:
+                hedged = True
+                try:
+                    start((pos + 1) % len(replicaGroup))
+                except ClerkTimeoutError:
+                    continue # no hedge, but the first call may still answer
+                pending += 1
+                self.stats.count("hedges")
+        return None
+
+    def group_by_shard(self, keys: List[str]) -> Dict[int, List[int]]:
+        # shard -> positions in keys, in order
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.shard_for(key), []).append(i)
+        return groups
+
+    def run_groups(self, groups: Dict[int, List[int]], fn):
+        # fn(shard, positions) for every shard, the batches for different
+        # replica groups are sent in parallel
+        # if a batch raises (ClerkTimeoutError when the retry policy gives
+        # up), the error is raised here once every batch is done, so the
+        # caller never gets a result with a batch missing
+        if len(groups) == 1:
+            for shard, positions in groups.items():
+                fn(shard, positions)
+            return
+        errors = []
+
+        def run(shard, positions):
+            try:
+                fn(shard, positions)
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(shard, positions), daemon=True)
+                   for shard, positions in groups.items()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+
+    # BASE CODE ----------------------------------------------------------------------
+    
+    def get(self, key: str) -> str:
+        # Fetch the current value for a key.
+        # Returns "" if the key does not exist.
+        # Keeps trying in the face of all other errors, until the retry
+        # policy gives up (forever by default) and raises ClerkTimeoutError.
+        args = GetArgs(key)
+        shard = self.shard_for(key)
+        attempts = Attempts(self.retry, self.stats, "KVServer.Get", self.clock, self.rand)
+        if self.hedge and len(self.replicaServersFor(shard)) > 1:
+            reply = self.hedged_call(shard, "KVServer.Get", args, attempts)
+            if reply is not None:
+                return reply.value
+        reply = self.call_group(shard, "KVServer.Get", args, attempts)
+        return reply.value
+
+
+    def start_request(self):
+        # assigning a unique id, and the ack that goes with it
         with self.lock:
             req_id = self.request_id
             self.request_id +=1
+            self.outstanding.add(req_id)
+            ack = min(self.outstanding)
+        return req_id, ack
 
-        args = PutAppendArgs(key, value, self.client_id, req_id)
-        replicaGroup = self.getReplicaServers(key)
-
-        # try all servers until get a response
-        while True:
-            for server in replicaGroup:
-                # again try each server insid ethe replica group
-                try:
-                    # similar logic to the modified get
-                    reply = server.call("KVServer." + op, args)
-                    # skip if reply is missing or 
-                    # if server is not the right shard
-                    if reply is None:
-                        continue
-
-                    if getattr(reply, "err","") == "WRONG_SHARD":
-                        continue
-
-                    # return actual val
-                    if op == "Append":
-
-                        return reply.value
-                    else:
-                        return ""
-                except Exception:
-                    continue
+    def finish_request(self, req_id: int):
+        with self.lock:
+            self.outstanding.discard(req_id)
 
+    # Shared by Put and Append.
+    def put_append(self, key: str, value: str, op: str) -> str:
+        req_id, ack = self.start_request()
+        try:
+            args = PutAppendArgs(key, value, self.client_id, req_id, ack)
+            reply = self.call_group(self.shard_for(key), "KVServer." + op, args)
+        finally:
+            self.finish_request(req_id)
 
+        # return actual val
+        if op == "Append":
+            return reply.value
+        else:
+            return ""
 
     def put(self, key: str, value: str):
         self.put_append(key, value, "Put")
@@ -124,3 +412,135 @@ class Clerk:
     # Append value to key's value and return that value
     def append(self, key: str, value: str) -> str:
         return self.put_append(key, value, "Append")
+
+
+    # BATCHED OPERATIONS --------------------------------------------------------------
+    # keys are grouped by shard and each group is sent as one RPC to its
+    # replica group, so a bulk load pays the RPC overhead once per shard
+    # instead of once per key
+
+    def multi_get(self, keys: List[str]) -> List[str]:
+        # values in the same order as keys
+        values = [""] * len(keys)
+
+        def get_batch(shard, positions):
+            args = MultiGetArgs([keys[i] for i in positions])
+            reply = self.call_group(shard, "KVServer.MultiGet", args)
+            for i, value in zip(positions, reply.values):
+                values[i] = value
+
+        self.run_groups(self.group_by_shard(keys), get_batch)
+        return values
+
+    def multi_put_append(self, keys: List[str], values: List[str], op: str) -> List[str]:
+        if len(keys) != len(values):
+            raise ValueError("keys and values must have the same length")
+        old_values = [""] * len(keys)
+
+        def put_append_batch(shard, positions):
+            # every batch is one request for duplicate detection
+            req_id, ack = self.start_request()
+            try:
+                args = MultiPutAppendArgs([keys[i] for i in positions], [values[i] for i in positions],
+                                          self.client_id, req_id, ack)
+                reply = self.call_group(shard, "KVServer." + op, args)
+            finally:
+                self.finish_request(req_id)
+            for i, value in zip(positions, reply.values):
+                old_values[i] = value
+
+        self.run_groups(self.group_by_shard(keys), put_append_batch)
+        return old_values
+
+    def multi_put(self, keys: List[str], values: List[str]):
+        self.multi_put_append(keys, values, "MultiPut")
+
+    # Append values to the keys and return the old values
+    # if a key shows up more than once, the appends happen in order
+    def multi_append(self, keys: List[str], values: List[str]) -> List[str]:
+        return self.multi_put_append(keys, values, "MultiAppend")
+
+
+# ASYNC CLERK ------------------------------------------------------------------------
+# same operations as Clerk, but as coroutines, so one thread can keep many
+# operations in flight instead of needing one thread per outstanding op.
+# it wraps a Clerk for the client id, request ids/acks, routing and retry
+# policy, so deduplication on the servers works exactly the same way.
+#
+# operations on the same key run in the order they were started (each one
+# waits for the previous one on that key), operations on different keys
+# are pipelined
+
+class AsyncClerk:
+    def __init__(self, servers: List[ClientEnd], cfg, retry: RetryPolicy = None):
+        self.clerk = Clerk(servers, cfg, retry)
+        self.client_id = self.clerk.client_id
+        self.stats = self.clerk.stats
+
+        # key -> [asyncio.Lock, number of ops using it]
+        # only touched from the event loop thread, so no locking needed
+        self.key_locks = {}
+
+    async def in_order(self, key: str, op):
+        entry = self.key_locks.get(key)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self.key_locks[key] = entry
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order
+            async with entry[0]:
+                return await op()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.key_locks[key]
+
+    async def call_group(self, shard: int, svcMeth: str, args: Any) -> Any:
+        # Clerk.call_group with awaits instead of blocking
+        clerk = self.clerk
+        replicaGroup = clerk.replicaServersFor(shard)
+        pos = clerk.first_server(shard)
+        attempts = Attempts(clerk.retry, clerk.stats, svcMeth, clerk.clock, clerk.rand)
+        while True:
+            for _ in range(len(replicaGroup)):
+                attempts.next()
+                server = replicaGroup[pos]
+                try:
+                    reply = await server.call_async(svcMeth, args, attempts.remaining())
+                    if valid_reply(reply):
+                        clerk.remember_server(shard, pos)
+                        return reply
+                except Exception:
+                    pass
+                pos = (pos + 1) % len(replicaGroup)
+
+            delay = attempts.backoff()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def get(self, key: str) -> str:
+        async def op():
+            reply = await self.call_group(self.clerk.shard_for(key), "KVServer.Get", GetArgs(key))
+            return reply.value
+        return await self.in_order(key, op)
+
+    async def put_append(self, key: str, value: str, op: str) -> str:
+        async def run():
+            # the request id is taken when the op actually starts, so ids
+            # on one key go up in the order the ops are applied
+            req_id, ack = self.clerk.start_request()
+            try:
+                args = PutAppendArgs(key, value, self.client_id, req_id, ack)
+                reply = await self.call_group(self.clerk.shard_for(key), "KVServer." + op, args)
+            finally:
+                self.clerk.finish_request(req_id)
+            return reply.value if op == "Append" else ""
+        return await self.in_order(key, run)
+
+    async def put(self, key: str, value: str):
+        await self.put_append(key, value, "Put")
+
+    # Append value to key's value and return the old value
+    async def append(self, key: str, value: str) -> str:
+        return await self.put_append(key, value, "Append")
@@ -0,0 +1,54 @@
+import random
+import sys
+import time
+
+from config import make_shard_config
+
+# tail latency of Clerk.get on an unreliable network, with and without
+# hedged reads. labrpc delays every request by 0-27ms and drops 10% of
+# requests and replies, so a plain get sometimes waits for a failed call.
+# with long reordering on, most replies are also held back for 200-2200ms,
+# which is the kind of tail hedging is meant for
+#
+#   python client_bench.py [ngets]
+
+NSHARDS = 3
+NREPLICAS = 3
+NKEYS = 30
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+def run(hedge: bool, reordering: bool, ngets: int):
+    cfg = make_shard_config(None, NSHARDS, NREPLICAS, True)
+    try:
+        cfg.hedged_reads = hedge
+        cfg.net.long_reordering(reordering)
+        ck = cfg.make_client()
+        for i in range(NKEYS):
+            ck.put(str(i), "x" * 100)
+
+        latencies = []
+        for _ in range(ngets):
+            key = str(random.randint(0, NKEYS - 1))
+            start = time.perf_counter()
+            ck.get(key)
+            latencies.append(time.perf_counter() - start)
+        return latencies, ck.stats.snapshot()
+    finally:
+        cfg.cleanup()
+
+def main():
+    ngets = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"{'network':>12} {'mode':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'rpcs':>6} {'hedges':>7}")
+    for reordering in [False, True]:
+        for hedge in [False, True]:
+            latencies, stats = run(hedge, reordering, ngets if not reordering else ngets // 10)
+            print(f"{'reordering' if reordering else 'unreliable':>12} {'hedged' if hedge else 'plain':>8} "
+                  f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+                  f"{percentile(latencies, 0.99) * 1000:>8.1f} {max(latencies) * 1000:>8.1f} "
+                  f"{stats['rpcs']:>6} {stats['hedges']:>7}")
+
+if __name__ == "__main__":
+    main()
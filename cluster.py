@@ -0,0 +1,106 @@
+import multiprocessing
+import threading
+from typing import List, Tuple
+
+from labrpc.labrpc import Service, Server
+from labrpc.transport import SocketServer, SocketNetwork
+from partitioner import StaticPartitioner
+from server import KVServer, DEFAULT_STRIPES
+from client import Clerk
+
+# runs every KVServer in its own process so the servers don't share one GIL
+# the servers talk to the clerks and to each other over the TCP transport
+# (labrpc/transport.py), a backup forwards to its primary with an RPC
+# instead of calling the primary's object directly
+#
+# Config(processes=True) uses this for the tests, and make_clerk() lets
+# other processes (like the clients of cluster_bench.py) use a cluster too
+
+class RemoteKVServer:
+    # stands in for a KVServer of another process in cfg.kvservers, so
+    # KVServer.forward() doesn't have to know where the primary is
+    # getattr(primary, "Put")(args) becomes a KVServer.Put RPC
+    def __init__(self, end):
+        self.end = end
+
+    def __getattr__(self, op):
+        def call(args):
+            return self.end.call("KVServer." + op, args)
+        return call
+
+class ProcessConfig:
+    # the parts of config.Config that KVServer and Clerk look at
+    def __init__(self, addresses, nreplicas=1, nstripes=DEFAULT_STRIPES, partitioner=None, name="peer"):
+        self.nservers = len(addresses)
+        self.nreplicas = nreplicas
+        self.nstripes = nstripes
+        self.partitioner = partitioner or StaticPartitioner()
+        self.net = SocketNetwork()
+        self.ends = []
+        for srvid, address in enumerate(addresses):
+            endname = f"{name}-{srvid}"
+            self.net.add_address(srvid, address)
+            self.ends.append(self.net.make_end(endname))
+            self.net.connect(endname, srvid)
+            self.net.enable(endname, True)
+        self.kvservers = [RemoteKVServer(e) for e in self.ends]
+
+def serve(me, nreplicas, nstripes, partitioner, pipe):
+    # body of a server process
+    # sends its address up the pipe, gets everybody's addresses back, and
+    # serves until the pipe says stop (or is closed)
+    rs = Server()
+    srv = SocketServer(rs)
+    pipe.send(srv.address)
+    addresses = pipe.recv()
+
+    cfg = ProcessConfig(addresses, nreplicas, nstripes, partitioner, f"peer-{me}")
+    rs.add_service(Service(KVServer(cfg, me)))
+    pipe.send("ready")
+
+    try:
+        pipe.recv()
+    except EOFError:
+        pass
+    srv.close()
+    cfg.net.cleanup()
+
+class ProcessCluster:
+    def __init__(self, nservers, nreplicas=1, nstripes=DEFAULT_STRIPES, partitioner=None):
+        # spawn, not fork: the parent has threads (network, clerks) and
+        # forking those is asking for trouble
+        ctx = multiprocessing.get_context("spawn")
+        self.procs = []
+        self.pipes = []
+        for srvid in range(nservers):
+            parent, child = ctx.Pipe()
+            p = ctx.Process(target=serve, args=(srvid, nreplicas, nstripes, partitioner, child), daemon=True)
+            p.start()
+            child.close()
+            self.procs.append(p)
+            self.pipes.append(parent)
+
+        self.addresses: List[Tuple[str, int]] = [pipe.recv() for pipe in self.pipes]
+        for pipe in self.pipes:
+            pipe.send(self.addresses)
+        for pipe in self.pipes:
+            pipe.recv()
+
+    def shutdown(self):
+        for pipe in self.pipes:
+            try:
+                pipe.send("stop")
+            except OSError:
+                pass
+        for p in self.procs:
+            p.join(2)
+            if p.is_alive():
+                p.terminate()
+        for pipe in self.pipes:
+            pipe.close()
+
+def make_clerk(addresses, nreplicas=1, partitioner=None, name=None) -> Clerk:
+    # a clerk for a ProcessCluster, from any process
+    cfg = ProcessConfig(addresses, nreplicas, partitioner=partitioner,
+                        name=name or f"clerk-{threading.get_ident()}")
+    return Clerk(cfg.ends, cfg)
@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from cluster import ProcessCluster, make_clerk
+from labgob import labgob
+
+# scaling benchmark for the multi-process cluster
+# for 1..N server processes (N = number of cores by default), runs two client
+# processes per server doing puts/appends/gets on random keys and reports the
+# total throughput. with the servers in one interpreter this number stays
+# flat as servers are added, with a process per server it should grow with
+# the number of cores
+#
+#   python cluster_bench.py [max servers] [seconds per run]
+
+NKEYS = 1000
+CLIENTS_PER_SERVER = 2
+
+def client(addresses, duration, seed, results):
+    ck = make_clerk(addresses)
+    rnd = random.Random(seed)
+    n = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        key = str(rnd.randint(0, NKEYS - 1))
+        r = rnd.random()
+        if r < 0.4:
+            ck.put(key, "x")
+        elif r < 0.6:
+            ck.append(key, "y")
+        else:
+            ck.get(key)
+        n += 1
+    results.put(n)
+
+def run(nservers: int, duration: float) -> float:
+    cluster = ProcessCluster(nservers)
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        nclients = nservers * CLIENTS_PER_SERVER
+        procs = [ctx.Process(target=client, args=(cluster.addresses, duration, i, results)) for i in range(nclients)]
+        for p in procs:
+            p.start()
+        total = sum(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+        return total / duration
+    finally:
+        cluster.shutdown()
+
+def main():
+    maxservers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    # no development checks in the servers and clients, they inherit this
+    os.environ["LABGOB_PRODUCTION"] = "1"
+    labgob.set_production(True)
+    print(f"{os.cpu_count()} cores")
+    print(f"{'servers':>8} {'clients':>8} {'ops/s':>10} {'per server':>11}")
+    for nservers in range(1, maxservers + 1):
+        ops = run(nservers, duration)
+        print(f"{nservers:>8} {nservers * CLIENTS_PER_SERVER:>8} {ops:>10.0f} {ops / nservers:>11.0f}")
+
+if __name__ == "__main__":
+    main()
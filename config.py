@@ -8,8 +8,11 @@ import logging
 import base64
 
 from labrpc.labrpc import Network, Service, Server
-from client import Clerk
+from labrpc.transport import SocketNetwork
+from cluster import ProcessCluster
+from client import Clerk, AsyncClerk
 from server import KVServer
+from partitioner import StaticPartitioner
 
 def randstring(n):
     b = os.urandom(2 * n)
@@ -22,10 +25,19 @@ def make_seed():
     return bigx
 
 class Config:
-    def __init__(self, t: unittest.TestCase):
+    # sim: a labrpc Simulator to run the whole test in simulated time
+    # tcp: run the servers on 127.0.0.1 ports and talk to them over TCP
+    # (see labrpc/transport.py) instead of the in-memory network
+    # processes: also run every server in its own process (see cluster.py),
+    # implies tcp
+    # tcp and processes need a reliable network, SocketNetwork can't drop
+    # or reorder messages
+    def __init__(self, t: unittest.TestCase, sim=None, tcp=False, processes=False):
         self.mu = threading.Lock()
         self.t = t
-        self.net = Network()
+        self.processes = processes
+        self.cluster = None
+        self.net = SocketNetwork() if tcp or processes else Network(sim=sim)
         self.nservers = 0
         self.kvservers = None
         self.running_servers = set()
@@ -35,22 +47,34 @@ class Config:
         self.rpcs0 = 0
         self.ops = 0
         self.nreplicas = 1
+        self.nstripes = 16 # lock stripes per KVServer
+        # key -> shard mapping used by both servers and clerks
+        self.partitioner = StaticPartitioner()
+        # retry policy for new clerks, None means the Clerk default
+        self.retry_policy = None
+        # whether new clerks use hedged gets
+        self.hedged_reads = False
 
     def cleanup(self):
         with self.mu:
             self.net.cleanup()
+            if self.cluster is not None:
+                self.cluster.shutdown()
 
-    def make_client(self):
+    def make_client(self, clerk_class=Clerk):
         with self.mu:
             endnames = [randstring(20) for i in range(self.nservers)]
             ends = [self.net.make_end(endname) for endname in endnames]
             for srvid in range(self.nservers):
                 self.net.connect(endnames[srvid], srvid)
-            ck = Clerk(ends, self)
+            ck = clerk_class(ends, self)
             self.clerks[ck] = endnames
             self.connect_client_unlocked(ck)
         return ck
 
+    def make_async_client(self):
+        return self.make_client(AsyncClerk)
+
     def delete_client(self, ck):
         with self.mu:
             for v in self.clerks[ck]:
@@ -68,9 +92,16 @@ class Config:
 
     def start_cluster(self, nservers):
         self.nservers = nservers
+        if self.processes:
+            # the servers live in other processes, kvservers stays None
+            self.cluster = ProcessCluster(nservers, self.nreplicas, self.nstripes, self.partitioner)
+            for srvid, address in enumerate(self.cluster.addresses):
+                self.net.add_address(srvid, address)
+                self.running_servers.add(srvid)
+            return
         self.kvservers = [None] * nservers
         for srvid in range(nservers):
-            self.kvservers[srvid] = KVServer(self)
+            self.kvservers[srvid] = KVServer(self, srvid)
             kvsvc = Service(self.kvservers[srvid])
             srv = Server()
             srv.add_service(kvsvc)
@@ -128,11 +159,15 @@ def make_single_config(t, unreliable):
     cfg.net.reliable(not unreliable)
     return cfg
 
-def make_shard_config(t, nshards, nreplicas, unreliable):
-    cfg = Config(t)
+def make_shard_config(t, nshards, nreplicas, unreliable, nstripes=16, sim=None, tcp=False, processes=False):
+    if unreliable and (tcp or processes):
+        # checked before any server is started
+        raise ValueError("config: unreliable networks are not supported with tcp or processes")
+    cfg = Config(t, sim, tcp, processes)
+    cfg.nstripes = nstripes
     cfg.clerks = {}
     cfg.start = time.time()
+    cfg.nreplicas = nreplicas # server processes need it before they start
     cfg.start_cluster(nshards)
-    cfg.nreplicas = nreplicas
     cfg.net.reliable(not unreliable)
     return cfg
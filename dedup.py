@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+# duplicate detection for KVServer
+# used to be a dict of (client_id, request_id) -> result that never forgot anything
+# now each client gets a small window of results:
+# - Clerk.request_id only goes up, and every request carries an ack, which is
+#   the lowest request id the client is still waiting on. everything below it
+#   is finished, so the client will never retry it and its result can be dropped
+# - clients that have not sent anything for idle_timeout seconds are forgotten
+# so memory is proportional to the active clients, not to the operations served
+
+class ClientSession:
+    __slots__ = ("acked", "results", "last_seen")
+
+    def __init__(self, now: float):
+        # every request id below acked is done
+        self.acked = 0
+        # request id -> result, only for ids >= acked
+        self.results: Dict[int, Any] = {}
+        self.last_seen = now
+
+    def ack(self, upto: int):
+        if upto <= self.acked:
+            return
+        self.acked = upto
+        for request_id in [r for r in self.results if r < upto]:
+            del self.results[request_id]
+
+class DedupTable:
+    # not thread safe by itself, the caller holds a lock
+    def __init__(self, idle_timeout: float = 60.0, clock=time.monotonic):
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        # least recently seen client first, so eviction only looks at the front
+        self.sessions: "OrderedDict[int, ClientSession]" = OrderedDict()
+
+    def _session(self, client_id: int) -> ClientSession:
+        now = self.clock()
+        session = self.sessions.get(client_id)
+        if session is None:
+            session = ClientSession(now)
+            self.sessions[client_id] = session
+        else:
+            session.last_seen = now
+            self.sessions.move_to_end(client_id)
+        self.evict_idle(now)
+        return session
+
+    def lookup(self, client_id: int, request_id: int, ack: int = 0) -> Tuple[bool, Any]:
+        # returns (True, result) if the request was already applied
+        # result is None if it was applied but already acked by the client,
+        # that can only be an old copy the client stopped waiting for
+        session = self._session(client_id)
+        session.ack(ack)
+        if request_id < session.acked:
+            return True, None
+        if request_id in session.results:
+            return True, session.results[request_id]
+        return False, None
+
+    def record(self, client_id: int, request_id: int, result: Any):
+        session = self._session(client_id)
+        if request_id >= session.acked:
+            session.results[request_id] = result
+
+    def evict_idle(self, now: float = None):
+        if now is None:
+            now = self.clock()
+        deadline = now - self.idle_timeout
+        while self.sessions:
+            client_id, session = next(iter(self.sessions.items()))
+            if session.last_seen >= deadline:
+                break
+            del self.sessions[client_id]
+
+    def __len__(self):
+        # number of results being remembered
+        return sum(len(s.results) for s in self.sessions.values())
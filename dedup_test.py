@@ -0,0 +1,46 @@
+import unittest
+
+from dedup import DedupTable
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestDedupTable(unittest.TestCase):
+    def test_duplicates(self):
+        d = DedupTable()
+        self.assertEqual(d.lookup(1, 0), (False, None))
+        d.record(1, 0, "a")
+        self.assertEqual(d.lookup(1, 0), (True, "a"))
+        # other clients are separate
+        self.assertEqual(d.lookup(2, 0), (False, None))
+
+    def test_ack(self):
+        d = DedupTable()
+        for i in range(100):
+            seen, _ = d.lookup(1, i, ack=i)
+            self.assertFalse(seen)
+            d.record(1, i, str(i))
+        # only the request that has not been acked yet is remembered
+        self.assertEqual(len(d), 1)
+        self.assertEqual(d.lookup(1, 99, ack=99), (True, "99"))
+        # an old copy of an acked request is still recognized
+        self.assertEqual(d.lookup(1, 3, ack=99), (True, None))
+
+    def test_idle_eviction(self):
+        clock = FakeClock()
+        d = DedupTable(idle_timeout=10, clock=clock)
+        d.lookup(1, 0)
+        d.record(1, 0, "a")
+        clock.now = 5
+        d.lookup(2, 0)
+        d.record(2, 0, "b")
+        clock.now = 12
+        d.evict_idle()
+        self.assertEqual(list(d.sessions.keys()), [2])
+        clock.now = 100
+        d.lookup(3, 0)
+        self.assertEqual(list(d.sessions.keys()), [3])
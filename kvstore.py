@@ -0,0 +1,119 @@
+from typing import Any, Dict, List
+
+# storage layer for KVServer.kv_store
+# appends used to do old_value + value which copies the whole value every time
+# (N appends to one key = O(N^2) bytes copied while holding the server lock)
+# instead each value is kept as a list of chunks and only joined when somebody
+# actually needs the full string, which can happen outside the server lock
+# note that KVServer.Append needs the full old value for its reply, so it
+# still copies the value once per append (outside the lock). only puts and
+# the appends themselves stopped copying (see kvstore_bench.py)
+
+class ValueSnapshot:
+    # a frozen view of a ChunkedValue: the first n chunks of a chunk list
+    # taking one is O(1), so it is safe to do while holding a lock
+    __slots__ = ("owner", "chunks", "n")
+
+    def __init__(self, owner, chunks: List[Any], n: int):
+        self.owner = owner
+        self.chunks = chunks
+        self.n = n
+
+    def materialize(self):
+        return self.owner.join(self.chunks, self.n)
+
+class ChunkedValue:
+    # append-only list of chunks, the value is the concatenation of all of them
+    # chunk lists are never modified except by appending, so a snapshot taken
+    # earlier always sees the same prefix even if more appends happen later
+    __slots__ = ("chunks", "size", "joined")
+
+    def __init__(self, value=""):
+        self.chunks = [value]
+        self.size = len(value)
+        # (chunk list, number of chunks, joined string) of the last materialize
+        # so repeated gets and appends only join the chunks added since then
+        self.joined = (self.chunks, 1, value)
+
+    def append(self, value):
+        chunks, n, joined = self.joined
+        if n > 1 and chunks is self.chunks and n == len(chunks):
+            # a reader already joined everything, start a new list from that
+            # string so the old small chunks can be garbage collected
+            # (old snapshots keep pointing at the old list, so they stay valid)
+            self.chunks = [joined]
+            self.joined = (self.chunks, 1, joined)
+        self.chunks.append(value)
+        self.size += len(value)
+
+    def snapshot(self) -> ValueSnapshot:
+        chunks = self.chunks
+        return ValueSnapshot(self, chunks, len(chunks))
+
+    def join(self, chunks: List[Any], n: int):
+        cached_chunks, cached_n, joined = self.joined
+        if cached_chunks is chunks and cached_n == n:
+            return joined
+
+        if cached_chunks is chunks and cached_n < n:
+            value = joined + joined[:0].join(chunks[cached_n:n])
+        else:
+            value = chunks[0][:0].join(chunks[:n])
+
+        # only remember it if it is newer than what we already have
+        # (this runs without a lock, but replacing the tuple is atomic)
+        if chunks is self.chunks and (cached_chunks is not chunks or n > cached_n):
+            self.joined = (chunks, n, value)
+        return value
+
+    def materialize(self):
+        return self.snapshot().materialize()
+
+def immutable(value):
+    # bytearray and memoryview values would be changed under us by whoever
+    # still holds them, and a memoryview can't be joined, so they are stored
+    # as bytes. str and bytes are kept as they are (no copy)
+    if type(value) is bytearray or type(value) is memoryview:
+        return bytes(value)
+    return value
+
+class KVStore:
+    # dict of key -> ChunkedValue
+    # writes to the same key have to be serialized by the caller (KVServer
+    # uses its stripe locks for that), get can run at the same time as writes
+    # since it only reads a dict entry and the length of a chunk list
+    def __init__(self):
+        self.data: Dict[str, ChunkedValue] = {}
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key: str) -> ValueSnapshot:
+        value = self.data.get(key)
+        if value is None:
+            return EMPTY
+        return value.snapshot()
+
+    def put(self, key: str, value):
+        # a new object instead of resetting the old one so that snapshots of
+        # the old value are not affected
+        self.data[key] = ChunkedValue(immutable(value))
+
+    def append(self, key: str, value) -> ValueSnapshot:
+        # returns a snapshot of the value before the append
+        value = immutable(value)
+        current = self.data.get(key)
+        if current is None:
+            self.data[key] = ChunkedValue(value)
+            return EMPTY
+        if type(value) is not type(current.chunks[0]):
+            # str and bytes chunks can't be joined, and every later get would fail
+            raise TypeError(f"can't append {type(value).__name__} to a {type(current.chunks[0]).__name__} value")
+        old = current.snapshot()
+        current.append(value)
+        return old
+
+EMPTY = ChunkedValue("").snapshot()
@@ -0,0 +1,67 @@
+import time
+
+from kvstore import KVStore
+from partitioner import StaticPartitioner
+from server import KVServer, PutAppendArgs
+
+# compare the cost of one append (the part done while holding a KVServer stripe lock)
+# as the value grows, for the chunked store vs plain string concatenation
+#
+# the last column is the whole KVServer.Append handler. it still has to
+# build the old value for the reply, which is a full copy of the value, so
+# N appends to one key still copy O(N^2) bytes in total, only outside the
+# lock now. that can't go away as long as Append returns the old value
+# (the reply has to carry all of it anyway)
+#
+#   python kvstore_bench.py
+
+MiB = 1024 * 1024
+CHUNK = "x" * 1024
+NAPPEND = 1000
+NHANDLER = 20 # the handler is a lot slower, fewer appends for it
+
+def bench_chunked(size: int) -> float:
+    kv = KVStore()
+    kv.put("k", "x" * size)
+    start = time.perf_counter()
+    for _ in range(NAPPEND):
+        kv.append("k", CHUNK)
+    return (time.perf_counter() - start) / NAPPEND
+
+def bench_concat(size: int) -> float:
+    kv = {"k": "x" * size}
+    start = time.perf_counter()
+    for _ in range(NAPPEND):
+        old_value = kv.get("k", "")
+        kv["k"] = old_value + CHUNK
+    return (time.perf_counter() - start) / NAPPEND
+
+class OneServerConfig:
+    # just enough of config.Config for one KVServer that owns every key
+    def __init__(self):
+        self.nservers = 1
+        self.nreplicas = 1
+        self.partitioner = StaticPartitioner()
+        self.kvservers = []
+
+def bench_handler(size: int) -> float:
+    cfg = OneServerConfig()
+    kv = KVServer(cfg, 0)
+    cfg.kvservers.append(kv)
+    kv.Put(PutAppendArgs("0", "x" * size, 1, 0))
+    start = time.perf_counter()
+    for i in range(NHANDLER):
+        kv.Append(PutAppendArgs("0", CHUNK, 1, i + 1, i + 1))
+    return (time.perf_counter() - start) / NHANDLER
+
+def main():
+    print(f"{'value size':>12} {'chunked us/append':>18} {'concat us/append':>18} {'handler us/append':>18}")
+    for mb in [1, 4, 16, 64]:
+        size = mb * MiB
+        chunked = bench_chunked(size)
+        concat = bench_concat(size)
+        handler = bench_handler(size)
+        print(f"{mb:>9} MiB {chunked * 1e6:>18.2f} {concat * 1e6:>18.2f} {handler * 1e6:>18.2f}")
+
+if __name__ == "__main__":
+    main()
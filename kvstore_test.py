@@ -0,0 +1,74 @@
+import unittest
+
+from kvstore import KVStore, ChunkedValue
+
+class TestChunkedValue(unittest.TestCase):
+    def test_append(self):
+        v = ChunkedValue("a")
+        for c in "bcdef":
+            v.append(c)
+        self.assertEqual(v.materialize(), "abcdef")
+        self.assertEqual(v.size, 6)
+
+    def test_snapshot(self):
+        # snapshots must keep the value they had when they were taken
+        v = ChunkedValue("x")
+        snaps = []
+        want = []
+        s = "x"
+        for i in range(20):
+            snaps.append(v.snapshot())
+            want.append(s)
+            v.append(str(i))
+            s += str(i)
+            if i % 3 == 0:
+                # materializing in between makes the next append compact the chunks
+                self.assertEqual(v.materialize(), s)
+        for snap, w in zip(snaps, want):
+            self.assertEqual(snap.materialize(), w)
+        self.assertEqual(v.materialize(), s)
+
+    def test_bytes(self):
+        v = ChunkedValue(b"ab")
+        v.append(b"cd")
+        self.assertEqual(v.materialize(), b"abcd")
+
+class TestKVStore(unittest.TestCase):
+    def test_put_append_get(self):
+        kv = KVStore()
+        self.assertEqual(kv.get("k").materialize(), "")
+
+        old = kv.append("k", "a")
+        self.assertEqual(old.materialize(), "")
+        old = kv.append("k", "b")
+        self.assertEqual(old.materialize(), "a")
+
+        before = kv.get("k")
+        kv.put("k", "z")
+        kv.append("k", "y")
+        self.assertEqual(before.materialize(), "ab")
+        self.assertEqual(kv.get("k").materialize(), "zy")
+        self.assertEqual(len(kv), 1)
+        self.assertIn("k", kv)
+
+    def test_mutable_buffers(self):
+        # stored as bytes, so later changes to the buffer don't show up and
+        # memoryviews can be joined
+        kv = KVStore()
+        buf = bytearray(b"ab")
+        kv.put("k", buf)
+        kv.append("k", memoryview(b"cd"))
+        buf[0] = ord("X")
+        self.assertEqual(kv.get("k").materialize(), b"abcd")
+        kv.append("m", memoryview(b"ef"))
+        self.assertIs(type(kv.get("m").materialize()), bytes)
+
+    def test_mixed_types(self):
+        # refused before anything changes, the value can still be read
+        kv = KVStore()
+        kv.put("k", b"abc")
+        with self.assertRaises(TypeError):
+            kv.append("k", "def")
+        self.assertEqual(kv.get("k").materialize(), b"abc")
+        kv.append("k", bytearray(b"d"))
+        self.assertEqual(kv.get("k").materialize(), b"abcd")
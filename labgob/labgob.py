@@ -1,5 +1,7 @@
+import os
 import pickle
 import io
+import struct
 import threading
 import inspect
 import logging
@@ -11,24 +13,269 @@ mu = threading.Lock()
 error_count = 0  # for TestCapital
 checked = {}
 
+# production mode skips the default value checks of decoded messages
+# (they only print warnings meant for development). tests keep the strict
+# mode, benchmarks and deployments can turn it off with set_production()
+# or LABGOB_PRODUCTION=1, which also reaches spawned server processes
+production = os.environ.get("LABGOB_PRODUCTION", "") not in ("", "0")
+
+def set_production(yes=True):
+    global production
+    production = yes
+
+# compact codec for registered message types
+# pickle writes the module and class name and every field name of an object
+# into every message. the types registered with register() are written as
+#   SCHEMA_TAG, type id (2 bytes), the int fields and the lengths of the
+#   str fields (8 and 4 bytes each), then the utf-8 bytes of the str fields
+# everything else, and registered objects whose fields don't fit the schema
+# (a bytes value, a huge int, a str with a lone surrogate, an extra
+# attribute), still goes through pickle.
+# pickle (protocol 2 and up) always starts with 0x80, so the decoder can
+# tell the two apart by the first byte
+
+SCHEMA_TAG = 0x01
+TYPE_ID = struct.Struct(">H")
+
+schemas = {}          # type -> Schema
+schemas_by_id = {}    # type id -> Schema
+
+class Schema:
+    # encode(e) and decode(r) are generated for each schema (the way
+    # dataclasses generates __init__), a generic loop over the fields was
+    # no faster than pickle's C code
+    def __init__(self, cls, type_id, fields):
+        self.cls = cls
+        self.type_id = type_id
+        self.names = [name for name, _ in fields]
+        self.kinds = [kind for _, kind in fields]
+        fields_format = "".join("q" if kind is int else "I" for kind in self.kinds)
+        header = struct.Struct(">BH" + fields_format)
+        body = struct.Struct(">" + fields_format)
+
+        n = len(fields)
+        strs = [i for i in range(n) if self.kinds[i] is str]
+        values = ", ".join(f"v{i}" for i in range(n))
+        encode = [
+            "def encode(e):",
+            "    # the encoded message, or None if e doesn't fit the schema",
+            "    try:",
+            "        d = e.__dict__",
+            f"        if len(d) != {n}:",
+            "            return None",
+        ]
+        encode += [f"        v{i} = d[{name!r}]" for i, name in enumerate(self.names)]
+        encode += [
+            "    except (AttributeError, KeyError):",
+            "        return None",
+            "    if " + " or ".join(f"type(v{i}) is not {self.kinds[i].__name__}" for i in range(n)) + ":",
+            "        return None",
+        ]
+        if strs:
+            # a lone surrogate can't be utf-8, pickle handles those
+            encode.append("    try:")
+            encode += [f"        s{i} = v{i}.encode()" for i in strs]
+            encode += [
+                "    except UnicodeEncodeError:",
+                "        return None",
+            ]
+        packed = ", ".join(f"len(s{i})" if i in strs else f"v{i}" for i in range(n))
+        encode += [
+            "    try:",
+            f"        return pack({SCHEMA_TAG}, {type_id}, {packed})" + "".join(f" + s{i}" for i in strs),
+            "    except struct.error:",
+            "        return None # int out of range",
+        ]
+
+        decode = [
+            "def decode(r):",
+            f"    {values}, = unpack(r.read({body.size}))",
+        ]
+        attrs = []
+        pos = "0"
+        if strs:
+            decode.append("    data = r.read(" + " + ".join(f"v{i}" for i in strs) + ")")
+        for i in range(n):
+            if i in strs:
+                end = f"v{i}" if pos == "0" else f"{pos} + v{i}"
+                attrs.append(f"{self.names[i]!r}: data[{pos}:{end}].decode()")
+                pos = end
+            else:
+                attrs.append(f"{self.names[i]!r}: v{i}")
+        decode += [
+            "    e = new(cls)",
+            "    e.__dict__.update({" + ", ".join(attrs) + "})",
+            "    return e",
+        ]
+
+        namespace = {"struct": struct, "pack": header.pack, "unpack": body.unpack, "new": cls.__new__, "cls": cls}
+        exec("\n".join(encode + decode), namespace)
+        self.encode = namespace["encode"]
+        self.decode = namespace["decode"]
+
+def register(cls, type_id, fields):
+    # fields: [(name, int or str), ...], every attribute the objects have
+    # type ids must be the same in every process that talks to each other
+    if not fields:
+        raise ValueError(f"labgob: no fields for {cls.__name__}")
+    with mu:
+        other = schemas_by_id.get(type_id)
+        if other is not None and other.cls is not cls:
+            raise ValueError(f"labgob: type id {type_id} of {cls.__name__} is already used by {other.cls.__name__}")
+        for name, kind in fields:
+            if kind not in (int, str):
+                raise ValueError(f"labgob: field {name} of {cls.__name__} has to be int or str")
+            if not isinstance(name, str) or not name.isidentifier():
+                raise ValueError(f"labgob: bad field name {name!r} of {cls.__name__}")
+        schema = Schema(cls, type_id, fields)
+        schemas[cls] = schema
+        schemas_by_id[type_id] = schema
+
+# out-of-band buffers for big binary values
+# an encoder given a buffers list doesn't copy bytes/bytearray values of at
+# least OOB_THRESHOLD bytes (or any memoryview) into the pickle, it appends
+# them to the list and only writes their index. the decoder is given the
+# same list and puts the objects back, so on the in-memory network a big
+# bytes value reaches the server without being copied at all. bytearray and
+# memoryview values are mutable, they are copied into bytes first (and
+# decode as bytes).
+# pickle protocol 5 has buffer_callback for this, but it only applies to
+# PickleBuffer objects: plain bytes take a fast path that neither it nor
+# reducer_override ever sees. persistent_id is called for every object
+
+OOB_THRESHOLD = 16 * 1024
+
+class BufferPickler(pickle.Pickler):
+    def __init__(self, w, buffers):
+        super().__init__(w)
+        self.buffers = buffers
+
+    def persistent_id(self, obj):
+        t = type(obj)
+        if t is bytes:
+            if len(obj) < OOB_THRESHOLD:
+                return None
+        elif t is memoryview or (t is bytearray and len(obj) >= OOB_THRESHOLD):
+            # the receiver would share the sender's mutable buffer, so
+            # these are copied once (into bytes) instead
+            obj = bytes(obj)
+        else:
+            return None
+        self.buffers.append(obj)
+        return len(self.buffers) - 1
+
+def is_big_buffer(v) -> bool:
+    t = type(v)
+    if t is bytes or t is bytearray:
+        return len(v) >= OOB_THRESHOLD
+    return t is memoryview
+
+BUFFER_TYPES = {bytes, bytearray, memoryview}
+
+def has_big_buffer(value) -> bool:
+    # whether value is worth a BufferPickler: persistent_id is a Python call
+    # for every object pickled, which makes a message with many small fields
+    # (a MultiPutAppendArgs) a lot slower to encode than the C Pickler.
+    # looks at value, its fields, and the items of lists, tuples and dicts
+    # among those (by type first, which runs in C). big buffers nested
+    # deeper than that are copied into the pickle, which is still correct
+    if is_big_buffer(value):
+        return True
+    fields = getattr(value, "__dict__", None)
+    items = fields.values() if fields is not None else (value,)
+    for v in items:
+        if is_big_buffer(v):
+            return True
+        t = type(v)
+        if t is dict:
+            v = v.values()
+        elif t is not list and t is not tuple:
+            continue
+        if not BUFFER_TYPES.isdisjoint(set(map(type, v))):
+            if any(map(is_big_buffer, v)):
+                return True
+    return False
+
+class BufferUnpickler(pickle.Unpickler):
+    def __init__(self, r, buffers):
+        super().__init__(r)
+        self.buffers = buffers
+
+    def persistent_load(self, pid):
+        return self.buffers[pid]
+
 class LabEncoder:
-    def __init__(self, w):
-        self.pickle = pickle.Pickler(w)
+    # buffers: list that big binary values go to instead of w (see above)
+    def __init__(self, w, buffers=None):
+        self.w = w
+        self.buffers = buffers
+        self.pickle = None
 
     def encode(self, e):
         check_value(e)
+        schema = schemas.get(type(e))
+        if schema is not None:
+            data = schema.encode(e)
+            if data is not None:
+                self.w.write(data)
+                return
+        if self.pickle is None:
+            if self.buffers is None:
+                self.pickle = pickle.Pickler(self.w)
+            else:
+                self.pickle = BufferPickler(self.w, self.buffers)
         self.pickle.dump(e)
 
+SCHEMA_TAG_BYTE = bytes([SCHEMA_TAG])
+
 class LabDecoder:
-    def __init__(self, r):
-        self.pickle = pickle.Unpickler(r)
+    # buffers: the list the LabEncoder filled, if it was given one
+    # the first byte of a message is looked at before deciding how to read
+    # it: with peek() if r has it (buffered files, sockets' makefile),
+    # else by seeking back (BytesIO). a reader that can do neither (a raw
+    # pipe or socket file) is wrapped in a BufferedReader
+    def __init__(self, r, buffers=None):
+        if not hasattr(r, "peek") and not seekable(r):
+            r = io.BufferedReader(r)
+        self.r = r
+        self.peek = getattr(r, "peek", None)
+        self.buffers = buffers
+        self.pickle = None
+
+    def is_schema(self):
+        # True if the next message is a schema one, and its tag has been read
+        if self.peek is not None:
+            if self.peek(1)[:1] != SCHEMA_TAG_BYTE:
+                return False
+            self.r.read(1)
+            return True
+        first = self.r.read(1)
+        if first == SCHEMA_TAG_BYTE:
+            return True
+        self.r.seek(-len(first), io.SEEK_CUR)
+        return False
 
     def decode(self):
-        e = self.pickle.load()
+        if self.is_schema():
+            type_id, = TYPE_ID.unpack(self.r.read(TYPE_ID.size))
+            e = schemas_by_id[type_id].decode(self.r)
+        else:
+            if self.pickle is None:
+                if self.buffers is None:
+                    self.pickle = pickle.Unpickler(self.r)
+                else:
+                    self.pickle = BufferUnpickler(self.r, self.buffers)
+            e = self.pickle.load()
         check_value(e)
         check_default(e)
         return e
 
+def seekable(r) -> bool:
+    try:
+        return r.seekable()
+    except AttributeError:
+        return False
+
 def check_value(value):
     check_type(type(value))
 
@@ -42,9 +289,25 @@ def check_type(t):
         print(f"labgob error: lower-case field {t.__name__} in RPC or persist/snapshot will break your Raft")
         error_count += 1
 
+# shapes (see shape()) whose default values have already been checked
+# the warning is printed at most once anyway, so checking every message of
+# a shape again only costs time, and the time grew with the payload
+defaults_checked = set()
+
+def shape(value):
+    # the type, plus the field names for objects
+    d = getattr(value, "__dict__", None)
+    if d is not None:
+        return (type(value), tuple(d))
+    return type(value)
+
 def check_default(value):
-    if value is None:
+    if value is None or production:
+        return
+    key = shape(value)
+    if key in defaults_checked:
         return
+    defaults_checked.add(key)
     check_default1(value, 1, "")
 
 def check_default1(value, depth, name):
@@ -70,7 +333,11 @@ def check_default1(value, depth, name):
             name1 = f"{name}.{attr}" if name else attr
             check_default1(val, depth + 1, name1)
     else:
-        if value != type(value)():
+        try:
+            default = type(value)()
+        except TypeError:
+            return # no default value, like memoryview
+        if value != default:
             if error_count < 1:
                 what = name or t.__name__
                 print(f"labgob warning: Decoding into a non-default variable/field {what} may not work")
@@ -0,0 +1,69 @@
+import io
+import pickle
+import sys
+import time
+
+from labgob import labgob
+from labgob.labgob import LabEncoder, LabDecoder
+from server import GetArgs, GetReply, PutAppendArgs, PutAppendReply, MultiGetReply
+
+# registered schema codec vs plain pickle for the KV messages
+# bytes per message and encode/decode time per message, the way labrpc
+# does it (a new encoder/decoder per message)
+#
+#   python -m labgob.labgob_bench
+
+MESSAGES = [
+    ("GetArgs", GetArgs("1234")),
+    ("GetReply", GetReply("x" * 100)),
+    ("PutAppendArgs", PutAppendArgs("1234", "x" * 100, 1 << 61, 12345, 12340)),
+    ("PutAppendReply", PutAppendReply("x" * 100)),
+]
+
+def encode_schema(m):
+    w = io.BytesIO()
+    LabEncoder(w).encode(m)
+    return w.getvalue()
+
+def encode_pickle(m):
+    # what LabEncoder did before the schema codec
+    w = io.BytesIO()
+    pickle.Pickler(w).dump(m)
+    return w.getvalue()
+
+def decode(data):
+    return LabDecoder(io.BytesIO(data)).decode()
+
+def per_op(fn, arg, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(arg)
+    return (time.perf_counter() - start) / n * 1e9
+
+def bench_validation(n):
+    # cost of the default value checks when decoding, by payload size
+    # "every message" is the walk that used to run on each decode
+    print(f"{'values':>7} {'every message ns':>17} {'cached ns':>10} {'production ns':>14}")
+    for nvalues in [1, 100, 10000]:
+        m = MultiGetReply(["x" * 10] * nvalues)
+        results = []
+        results.append(per_op(lambda v: labgob.check_default1(v, 1, ""), m, max(1, n // nvalues)))
+        results.append(per_op(labgob.check_default, m, n))
+        labgob.set_production(True)
+        results.append(per_op(labgob.check_default, m, n))
+        labgob.set_production(False)
+        print(f"{nvalues:>7} {results[0]:>17.0f} {results[1]:>10.0f} {results[2]:>14.0f}")
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"{'message':>15} {'codec':>7} {'bytes':>6} {'encode ns':>10} {'decode ns':>10}")
+    for name, m in MESSAGES:
+        for codec, encode in [("pickle", encode_pickle), ("schema", encode_schema)]:
+            data = encode(m)
+            enc = per_op(encode, m, n)
+            dec = per_op(decode, data, n)
+            print(f"{name:>15} {codec:>7} {len(data):>6} {enc:>10.0f} {dec:>10.0f}")
+    bench_validation(n)
+
+if __name__ == "__main__":
+    main()
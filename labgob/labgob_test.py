@@ -1,6 +1,7 @@
 import unittest
 import pickle
 import io
+import os
 
 from labgob.labgob import *
 
@@ -126,3 +127,103 @@ class TestDefault(unittest.TestCase):
         r = io.BytesIO(data)
         d = LabDecoder(r)
         reply = d.decode()
+
+class S1:
+    def __init__(self, Name="", Count=0):
+        self.Name = Name
+        self.Count = Count
+
+register(S1, 1001, [("Name", str), ("Count", int)])
+
+# registered types use the compact encoding, anything that doesn't fit
+# its schema still goes through pickle
+class TestSchema(unittest.TestCase):
+    def test_schema(self):
+        s = S1("héllo", -7)
+
+        w = io.BytesIO()
+        LabEncoder(w).encode(s)
+        data = w.getvalue()
+        self.assertEqual(data[0], SCHEMA_TAG)
+        self.assertLess(len(data), len(pickle.dumps(s)))
+
+        big = S1("x", 1 << 70)
+        raw = S1(b"bytes", 1)
+        extra = S1("y", 2)
+        extra.Other = 3
+
+        w = io.BytesIO()
+        e = LabEncoder(w)
+        for v in [s, big, [1, 2], raw, s, extra, S1()]:
+            e.encode(v)
+        data = w.getvalue()
+
+        d = LabDecoder(io.BytesIO(data))
+        for want in [s, big]:
+            got = d.decode()
+            self.assertIsInstance(got, S1)
+            self.assertEqual(got.__dict__, want.__dict__)
+        self.assertEqual(d.decode(), [1, 2])
+        for want in [raw, s, extra, S1()]:
+            self.assertEqual(d.decode().__dict__, want.__dict__)
+
+        with self.assertRaises(ValueError):
+            register(T3, 1001, [("T3int999", int)])
+
+    def test_surrogates(self):
+        # not valid utf-8, goes through pickle instead
+        s = S1("a\udc80b", 1)
+        w = io.BytesIO()
+        LabEncoder(w).encode(s)
+        self.assertNotEqual(w.getvalue()[0], SCHEMA_TAG)
+        self.assertEqual(LabDecoder(io.BytesIO(w.getvalue())).decode().__dict__, s.__dict__)
+
+    def test_not_seekable(self):
+        # a pipe or a socket can't seek back over the first byte
+        w = io.BytesIO()
+        e = LabEncoder(w)
+        for v in [S1("x", 1), [1, 2], S1("y", 2)]:
+            e.encode(v)
+        rfd, wfd = os.pipe()
+        os.write(wfd, w.getvalue())
+        os.close(wfd)
+        with open(rfd, "rb", buffering=0) as r:
+            d = LabDecoder(r)
+            self.assertEqual(d.decode().__dict__, {"Name": "x", "Count": 1})
+            self.assertEqual(d.decode(), [1, 2])
+            self.assertEqual(d.decode().__dict__, {"Name": "y", "Count": 2})
+
+class DC:
+    def __init__(self, Items=None):
+        self.Items = Items if Items is not None else []
+
+# default value checks run once per type and field names
+class TestDefaultCache(unittest.TestCase):
+    def test_default_cache(self):
+        from labgob import labgob
+
+        def roundtrip(v):
+            w = io.BytesIO()
+            LabEncoder(w).encode(v)
+            return LabDecoder(io.BytesIO(w.getvalue())).decode()
+
+        e0 = labgob.error_count
+        self.assertEqual(roundtrip(DC([1, 2])).Items, [1, 2])
+        e1 = labgob.error_count
+        self.assertGreater(e1, e0)
+        roundtrip(DC(list(range(1000))))
+        self.assertEqual(labgob.error_count, e1)
+
+        # a different set of fields is a different shape
+        d = DC([3])
+        d.Extra = 5
+        roundtrip(d)
+        self.assertGreater(labgob.error_count, e1)
+
+        labgob.set_production(True)
+        try:
+            e2 = labgob.error_count
+            roundtrip(T1(1, 2, "x", "y"))
+            self.assertEqual(labgob.error_count, e2)
+        finally:
+            labgob.set_production(False)
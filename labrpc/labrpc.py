@@ -1,72 +1,614 @@
+import asyncio
 import threading
 import logging
 import random
 import time
 import io
+import heapq
+import itertools
+import pickle
 import queue
 from collections import defaultdict
 
-from labgob.labgob import LabEncoder, LabDecoder
+from labgob.labgob import LabEncoder, LabDecoder, has_big_buffer
 
 logging.basicConfig(level=logging.FATAL)
 
+# svcMeth of a batch of calls, see ClientEnd.add_to_batch and Server.dispatch_batch
+BATCH = "labrpc.Batch"
+
 class ReqMsg:
-    def __init__(self, endname, svcMeth, argsType, args):
+    def __init__(self, endname, svcMeth, argsType, args, replyCh=None, buffers=None):
         self.endname = endname  # name of sending ClientEnd
         self.svcMeth = svcMeth  # e.g. "Raft.AppendEntries"
         self.argsType = argsType
         self.args = args
-        self.replyCh = queue.Queue()
+        # anything with put(), the network puts exactly one ReplyMsg into it
+        self.replyCh = replyCh if replyCh is not None else ReplyFuture()
+        # big binary values of args, passed along instead of copied into
+        # args (see labgob OOB_THRESHOLD)
+        self.buffers = buffers
 
 class ReplyMsg:
-    def __init__(self, ok, reply):
+    def __init__(self, ok, reply, buffers=None):
         self.ok = ok
         self.reply = reply
+        self.buffers = buffers
+
+def fail_req(req):
+    # the call fails with a timeout, like a dropped message
+    if req is not None:
+        req.replyCh.put(ReplyMsg(False, None))
+
+def fail_reqs(reqs):
+    for req in reqs:
+        fail_req(req)
+
+def encode(value):
+    # (labgob bytes, out-of-band buffers or None)
+    # only messages that can hold a big buffer go through the slower
+    # BufferPickler, see labgob.has_big_buffer
+    if not has_big_buffer(value):
+        qb = io.BytesIO()
+        try:
+            LabEncoder(qb).encode(value)
+            return qb.getvalue(), None
+        except TypeError:
+            # a memoryview nested deeper than has_big_buffer looks, which
+            # only the BufferPickler can take
+            pass
+    qb = io.BytesIO()
+    buffers = []
+    LabEncoder(qb, buffers).encode(value)
+    return qb.getvalue(), buffers or None
+
+def decode(data, buffers):
+    return LabDecoder(io.BytesIO(data), buffers).decode()
+
+def split_buffers(entries, buffers):
+    # batches: entries are (x, data, number of buffers), buffers the
+    # buffers of every entry in order. yields (x, data, its buffers or None)
+    pos = 0
+    for x, data, nbufs in entries:
+        if nbufs:
+            yield x, data, buffers[pos:pos + nbufs]
+            pos += nbufs
+        else:
+            yield x, data, None
+
+def msg_size(msg):
+    # bytes of a ReqMsg on the wire, buffers included
+    n = len(msg.args)
+    if msg.buffers:
+        n += sum(memoryview(b).nbytes for b in msg.buffers)
+    return n
+
+# one-shot slot for the reply of one call
+# a queue.Queue per call costs a mutex, three conditions and a deque just
+# to hand over one value. this is two plain locks: one that makes the
+# first put() win, and one that waiters block on until the value is there
+# callbacks let async callers use the same thing (see call_async)
+class ReplyFuture:
+    __slots__ = ("value", "done", "mu", "waiter", "callbacks")
+
+    def __init__(self):
+        self.value = None
+        self.done = False
+        self.mu = threading.Lock()
+        self.waiter = threading.Lock()
+        self.waiter.acquire()  # released once the value is set
+        self.callbacks = None
+
+    def put(self, value, block=True, timeout=None):
+        # same signature as queue.Queue.put, so the network doesn't care
+        # which one it gets. returns False if a value was already set
+        with self.mu:
+            if self.done:
+                return False
+            self.value = value
+            self.done = True
+            callbacks = self.callbacks
+            self.callbacks = None
+        self.waiter.release()
+        if callbacks:
+            for fn in callbacks:
+                fn(value)
+        return True
+
+    def get(self, block=True, timeout=None):
+        # waits for the value, raises TimeoutError if it doesn't show up in time
+        if not self.done:
+            if not self.waiter.acquire(block, -1 if timeout is None else timeout):
+                raise TimeoutError()
+            # let the next waiter through too
+            self.waiter.release()
+        return self.value
+
+    def add_done_callback(self, fn):
+        # fn(value) runs on the thread that puts the value, or right away
+        # if it is already there
+        with self.mu:
+            if not self.done:
+                if self.callbacks is None:
+                    self.callbacks = []
+                self.callbacks.append(fn)
+                return
+        fn(self.value)
 
 class ClientEnd:
     def __init__(self, endname, network):
         self.endname = endname  # this end-point's name
-        self.ch = network.endCh
+        self.ch = network.ingress_for(endname).ch
         self.done = network.done
-
-    def call(self, svcMeth, args):
-        qb = io.BytesIO()
-        LabEncoder(qb).encode(args);
-        req = ReqMsg(self.endname, svcMeth, type(args), qb.getvalue())
+        self.sim = network.sim
+        self.network = network
+        # calls waiting to go out as one batch, see add_to_batch
+        self.batch_mu = threading.Lock()
+        self.batch = None
+
+    def send(self, svcMeth, args, replyCh=None):
+        # encoded here even if it goes out in a batch, so arguments that
+        # can't be encoded raise in the caller
+        data, buffers = encode(args)
+        req = ReqMsg(self.endname, svcMeth, type(args), data, replyCh, buffers)
+
+        if self.network.batch_window is not None:
+            self.add_to_batch(req)
+            if self.done.is_set():
+                # cleaned up while we were adding it, see Network.cleanup
+                self.fail_batch()
+            return req
 
         # Send the request
         try:
             self.ch.put(req, block=False)
         except queue.Full:
             raise TimeoutError()
+        if self.done.is_set() and self.sim is None:
+            # nothing is reading self.ch anymore
+            self.network.ingress_for(self.endname).fail_pending()
+        return req
+
+    # request batching (Network.batching): calls made within batch_window
+    # of the first one go out as a single request, which the network
+    # delivers, delays or drops as a whole, and Server.dispatch_batch runs
+    # one by one. the replies come back in one reply and are handed to
+    # their callers from there
+
+    def add_to_batch(self, req):
+        window, max_batch = self.network.batch_window, self.network.max_batch
+        with self.batch_mu:
+            first = self.batch is None
+            if first:
+                self.batch = []
+            self.batch.append(req)
+            full = None
+            if len(self.batch) >= max_batch:
+                full, self.batch = self.batch, None
+        if full is not None:
+            self.send_batch(full)
+        elif first:
+            self.network.scheduler.call_later(window, self.flush_batch)
+
+    def flush_batch(self):
+        with self.batch_mu:
+            batch, self.batch = self.batch, None
+        if batch:
+            self.send_batch(batch)
+
+    def fail_batch(self):
+        with self.batch_mu:
+            batch, self.batch = self.batch, None
+        if batch:
+            fail_reqs(batch)
+
+    def send_batch(self, reqs):
+        if len(reqs) == 1:
+            req = reqs[0]
+        else:
+            # the calls are already encoded (see send), the batch only puts
+            # them together: every method name once, then (method, args,
+            # number of buffers) per call. the buffers of every call go in
+            # order into the buffers of the batch, like the replies
+            methods = {}
+            calls = []
+            buffers = []
+            for r in reqs:
+                method = methods.setdefault(r.svcMeth, len(methods))
+                calls.append((method, r.args, len(r.buffers) if r.buffers else 0))
+                if r.buffers:
+                    buffers.extend(r.buffers)
+            envelope = pickle.dumps((list(methods), calls))
+            req = ReqMsg(self.endname, BATCH, list, envelope, None, buffers or None)
+            req.replyCh.add_done_callback(lambda rep: self.split_reply(reqs, rep))
+        try:
+            self.ch.put(req, block=False)
+        except queue.Full:
+            for r in reqs:
+                r.replyCh.put(ReplyMsg(False, None))
+            return
+        if self.done.is_set() and self.sim is None:
+            self.network.ingress_for(self.endname).fail_pending()
 
-        # Wait for the reply
-        rep = req.replyCh.get()
+    def split_reply(self, reqs, rep):
+        if rep.ok:
+            for r, (ok, reply, buffers) in zip(reqs, split_buffers(pickle.loads(rep.reply), rep.buffers)):
+                r.replyCh.put(ReplyMsg(ok, reply, buffers))
+        else:
+            for r in reqs:
+                r.replyCh.put(ReplyMsg(False, None))
+
+    def decode_reply(self, rep):
         if rep.ok:
-            return LabDecoder(io.BytesIO(rep.reply)).decode()
+            return decode(rep.reply, rep.buffers)
         else:
             raise TimeoutError()
 
-class Network:
+    # timeout is in seconds, None waits until the network gives up
+    def call(self, svcMeth, args, timeout=None):
+        req = self.send(svcMeth, args)
+
+        if self.sim is not None:
+            # simulated network: nothing else is going to deliver the reply,
+            # so run the simulation until it shows up (or the timeout passes
+            # in simulated time)
+            if not self.sim.run_until(lambda: req.replyCh.done, timeout):
+                raise TimeoutError()
+
+        # Wait for the reply
+        try:
+            rep = req.replyCh.get(timeout=timeout)
+        except TimeoutError:
+            self.abandon(req)
+            raise
+        return self.decode_reply(rep)
+
+    def abandon(self, req):
+        # the caller stopped waiting for req's reply, nothing to clean up here
+        pass
+
+    # same as call(), but waits for the reply without blocking the event
+    # loop, so one thread can have many calls outstanding
+    async def call_async(self, svcMeth, args, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_reply(rep):
+            # runs on a network thread, hand the reply over to the loop's thread
+            try:
+                loop.call_soon_threadsafe(set_reply, rep)
+            except RuntimeError:
+                pass  # the loop is closed, nobody is waiting anymore
+
+        def set_reply(rep):
+            if not future.done():
+                future.set_result(rep)
+
+        req = self.send(svcMeth, args)
+        req.replyCh.add_done_callback(on_reply)
+        try:
+            rep = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.abandon(req)
+            raise TimeoutError()
+        return self.decode_reply(rep)
+
+# fixed set of threads running the network's tasks (delivering a request to
+# its server and running the handler), instead of two new threads per RPC
+# nworkers=0 gives the old behavior of one new thread per task
+class WorkerPool:
+    def __init__(self, nworkers):
+        self.nworkers = nworkers
+        self.tasks = queue.SimpleQueue()
+        self.threads = []
+        for i in range(nworkers):
+            t = threading.Thread(target=self._worker, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def _worker(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            fn, args = task
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception("labrpc: task failed")
+
+    def submit(self, fn, *args):
+        if self.nworkers == 0:
+            threading.Thread(target=fn, args=args, daemon=True).start()
+        else:
+            self.tasks.put((fn, args))
+
+    def queue_depth(self):
+        # tasks waiting for a free worker
+        return self.tasks.qsize()
+
+    def shutdown(self):
+        for _ in self.threads:
+            self.tasks.put(None)
+
+# one thread that runs every delayed action of the network (delayed
+# deliveries, delayed replies, failures of calls to dead servers) from a
+# heap ordered by due time. thousands of delayed RPCs are just heap entries
+# instead of sleeping threads or threading.Timers
+# actions run on the scheduler thread, so they must be quick (put a reply,
+# hand work to the worker pool)
+class Scheduler:
     def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []  # (due time, sequence number, fn, args, req)
+        self.seq = itertools.count()
+        self.stopped = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # req: the request whose caller waits for this action, it gets a failed
+    # reply instead if the scheduler is shut down before the action runs
+    def call_later(self, delay, fn, *args, req=None):
+        with self.cond:
+            if self.stopped:
+                fail_req(req)
+                return
+            seq = next(self.seq)
+            heapq.heappush(self.heap, (time.monotonic() + delay, seq, fn, args, req))
+            # only need to wake up the thread if this is the new earliest entry
+            if self.heap[0][1] == seq:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    if not self.heap:
+                        self.cond.wait()
+                        continue
+                    wait = self.heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                if self.stopped:
+                    return
+                _, _, fn, args, _ = heapq.heappop(self.heap)
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception("labrpc: scheduled task failed")
+
+    def pending(self):
+        with self.cond:
+            return len(self.heap)
+
+    def shutdown(self):
+        with self.cond:
+            self.stopped = True
+            heap, self.heap = self.heap, []
+            self.cond.notify()
+        fail_reqs(entry[4] for entry in heap)
+
+# clock used by real networks, Simulator has the same two methods
+class RealClock:
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+REAL_CLOCK = RealClock()
+
+# deterministic discrete event simulation, for Network(sim=Simulator(seed))
+# instead of threads and real sleeps, everything the network does (deliver a
+# request, run a handler, send back a delayed reply, fail a call) is an
+# event on a heap ordered by simulated time. the simulation only runs when
+# somebody waits: ClientEnd.call() and sleep() run events until the reply
+# shows up or the time has passed, jumping straight to the next event, so
+# seconds of delays cost nothing.
+# all random choices of the network come from self.rand, so with one
+# thread driving the simulation the same seed gives exactly the same drops,
+# delays and reorderings every time.
+# the driving code has to be single threaded (no hedged reads, AsyncClerk
+# or client threads), everything runs on the caller's thread.
+class Simulator:
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.rand = random.Random(seed)
+        self.time = 0.0
+        self.heap = []  # (due time, sequence number, fn, args)
+        self.seq = itertools.count()
+        self.events = 0 # number of events run so far
+
+    def now(self):
+        return self.time
+
+    def call_later(self, delay, fn, *args, req=None):
+        heapq.heappush(self.heap, (self.time + delay, next(self.seq), fn, args, req))
+
+    def pending(self):
+        return len(self.heap)
+
+    def shutdown(self):
+        heap, self.heap = self.heap, []
+        fail_reqs(entry[4] for entry in heap)
+
+    def step(self):
+        when, _, fn, args, _ = heapq.heappop(self.heap)
+        if when > self.time:
+            self.time = when
+        self.events += 1
+        fn(*args)
+
+    def run_until(self, cond, timeout=None):
+        # runs events until cond() is true, returns False if timeout (in
+        # simulated seconds) passes first. with no timeout and nothing left
+        # to run, cond can never become true, which is a bug in the caller
+        deadline = None if timeout is None else self.time + timeout
+        while not cond():
+            if not self.heap:
+                if deadline is None:
+                    raise RuntimeError("labrpc.Simulator: waiting for something that can never happen")
+                self.time = max(self.time, deadline)
+                return False
+            if deadline is not None and self.heap[0][0] > deadline:
+                self.time = max(self.time, deadline)
+                return cond()
+            self.step()
+        return True
+
+    def sleep(self, seconds):
+        # lets simulated time pass, running everything that is due meanwhile
+        deadline = self.time + seconds
+        while self.heap and self.heap[0][0] <= deadline:
+            self.step()
+        self.time = max(self.time, deadline)
+
+    def run(self, seconds=None):
+        # runs everything that is left (or everything due in the next seconds)
+        if seconds is not None:
+            self.sleep(seconds)
+            return
+        while self.heap:
+            self.step()
+
+# Network.pool for simulated networks, tasks become events that run right away
+class SimPool:
+    def __init__(self, sim):
+        self.sim = sim
+
+    def submit(self, fn, *args):
+        self.sim.call_later(0, fn, *args)
+
+    def queue_depth(self):
+        return 0
+
+    def shutdown(self):
+        pass
+
+# Network.ingress for simulated networks
+class SimIngress:
+    def __init__(self, network):
+        self.network = network
+        self.ch = self # ClientEnd only needs ch.put()
+        self.count = 0
+        self.bytes = 0
+
+    def put(self, req, block=True, timeout=None):
+        self.count += 1
+        self.bytes += msg_size(req)
+        self.network.sim.call_later(0, self.network.process_req, req)
+
+    def qsize(self):
+        return 0
+
+    def fail_pending(self):
+        pass
+
+# one of the network's request queues and the thread that drains it
+# every ClientEnd sends into the ingress picked by its name, so the ends are
+# spread over several consumers instead of all going through one thread
+# count and bytes are only written by the consumer thread, no lock needed
+class Ingress:
+    def __init__(self, network):
+        self.network = network
+        self.ch = queue.Queue()
+        self.count = 0
+        self.bytes = 0
+        threading.Thread(target=self._process_requests, daemon=True).start()
+
+    def _process_requests(self):
+        network = self.network
+        while not network.done.is_set():
+            try:
+                xreq = self.ch.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if network.done.is_set():
+                fail_req(xreq)
+                break
+
+            self.count += 1
+            self.bytes += msg_size(xreq)
+
+            network.process_req(xreq)
+
+    def fail_pending(self):
+        # after cleanup: nobody is going to take these requests anymore
+        while True:
+            try:
+                fail_req(self.ch.get_nowait())
+            except queue.Empty:
+                return
+
+# an RPC whose handler is running, see Network.fail_inflight
+class InFlight:
+    def __init__(self, call_id, req, servername, server):
+        self.call_id = call_id
+        self.req = req
+        self.servername = servername
+        self.server = server
+
+class Network:
+    # sim: a Simulator to run the network in simulated time instead of on
+    # threads (see Simulator), None for the normal threaded network
+    def __init__(self, nworkers=64, ningress=4, sim=None):
         self.mu = threading.Lock()
         self.isreliable = True
         self.longDelays = False
         self.longReordering = False
+        # seconds ends wait to batch up calls, None sends every call by itself
+        self.batch_window = None
+        self.max_batch = 64
         self.ends = {}
         self.enabled = {}
         self.servers = {}
         self.connections = {}
-        self.endCh = queue.Queue()
         self.done = threading.Event()
-        self.count = 0
-        self.bytes = 0
 
-        # single thread to handle all ClientEnd.call()s
-        threading.Thread(target=self._process_requests, daemon=True).start()
+        self.sim = sim
+        if sim is not None:
+            # same seed, same faults
+            self.rand = sim.rand
+            self.clock = sim
+            self.pool = SimPool(sim)
+            self.scheduler = sim
+            self.ingress = [SimIngress(self)]
+        else:
+            self.rand = random.Random()
+            self.clock = REAL_CLOCK
+
+            # requests are delivered and handled by a bounded pool of workers
+            # note that a handler that blocks holds on to its worker, and handlers
+            # that wait for other RPCs on the same network can run the pool dry
+            self.pool = WorkerPool(nworkers)
+
+            # every simulated delay goes through this one thread
+            self.scheduler = Scheduler()
+
+        # calls whose handler is running, by end and by server, so that
+        # enable(), delete_end(), add_server() and delete_server() can fail
+        # them right away instead of somebody polling for dead servers
+        self.inflight_ends = defaultdict(dict)     # endname -> call id -> InFlight
+        self.inflight_servers = defaultdict(dict)  # servername -> call id -> InFlight
+        self.next_call = 0
+
+        # threads that handle the ClientEnd.call()s, each for its share of the ends
+        if sim is None:
+            self.ingress = [Ingress(self) for _ in range(ningress)]
 
     def cleanup(self):
+        # calls that are still waiting for a delayed action, sit in an
+        # ingress queue or in an unsent batch fail right away, instead of
+        # waiting for a reply nobody is going to send
         self.done.set()
+        self.pool.shutdown()
+        self.scheduler.shutdown()
+        for ingress in self.ingress:
+            ingress.fail_pending()
+        with self.mu:
+            ends = list(self.ends.values())
+        for e in ends:
+            e.fail_batch()
 
     def reliable(self, yes):
         with self.mu:
@@ -80,18 +622,14 @@ class Network:
         with self.mu:
             self.longDelays = yes
 
-    def _process_requests(self):
-        while not self.done.is_set():
-            try:
-                xreq = self.endCh.get(timeout=0.1)
-            except queue.Empty:
-                continue
-
-            with self.mu:
-                self.count += 1
-                self.bytes += len(xreq.args)
+    # window in seconds, None turns batching off (see ClientEnd.add_to_batch)
+    def batching(self, window, max_batch=64):
+        with self.mu:
+            self.batch_window = window
+            self.max_batch = max_batch
 
-            threading.Thread(target=self.process_req, args=(xreq,), daemon=True).start()
+    def ingress_for(self, endname):
+        return self.ingress[hash(endname) % len(self.ingress)]
 
     def read_endname_info(self, endname):
         with self.mu:
@@ -103,51 +641,92 @@ class Network:
 
         return enabled, servername, server, isreliable, long_reordering
 
-    def is_server_dead(self, endname, servername, server):
-        with self.mu:
-            return not self.enabled[endname] or self.servers[servername] != server
+    # the next three are called with self.mu held
+
+    def add_inflight(self, req, servername, server):
+        # returns None if the end or server died while the request was on
+        # its way, the call has to fail then
+        if not self.enabled.get(req.endname, False) or self.servers.get(servername) != server:
+            return None
+        call = InFlight(self.next_call, req, servername, server)
+        self.next_call += 1
+        self.inflight_ends[req.endname][call.call_id] = call
+        self.inflight_servers[servername][call.call_id] = call
+        return call
+
+    def remove_inflight(self, call):
+        # false if the call was already failed by fail_inflight
+        calls = self.inflight_ends.get(call.req.endname)
+        if calls is None or calls.pop(call.call_id, None) is None:
+            return False
+        if not calls:
+            del self.inflight_ends[call.req.endname]
+        calls = self.inflight_servers[call.servername]
+        del calls[call.call_id]
+        if not calls:
+            del self.inflight_servers[call.servername]
+        return True
+
+    def fail_inflight(self, calls):
+        # a call whose server is killed (or end disabled) while its handler is
+        # still running fails right away, like it would on a real network
+        # the handler keeps running, its reply is thrown away
+        failed = [call for call in list(calls) if self.remove_inflight(call)]
+        for call in failed:
+            # only queues the reply, safe to do while holding self.mu
+            call.req.replyCh.put(ReplyMsg(False, None))
 
     def process_req(self, req):
+        # runs on an ingress thread, decides what happens to the request
+        # and hands it to the scheduler or the worker pool without blocking
         enabled, servername, server, isreliable, long_reordering = self.read_endname_info(req.endname)
         if enabled and (servername is not None) and (server is not None):
+            delay = 0
             if not isreliable:
-                time.sleep(random.randint(0, 27) / 1000)
-
-            if not isreliable and random.randint(0, 999) < 100:
-                req.replyCh.put(ReplyMsg(False, None))
-                return
+                delay = self.rand.randint(0, 27) / 1000
 
-            ech = queue.Queue()
+            if not isreliable and self.rand.randint(0, 999) < 100:
+                # dropped, the caller finds out after the delay
+                self.scheduler.call_later(delay, req.replyCh.put, ReplyMsg(False, None), req=req)
+            elif delay > 0:
+                self.scheduler.call_later(delay, self.pool.submit, self.deliver, req, servername, server, isreliable, long_reordering, req=req)
+            else:
+                self.pool.submit(self.deliver, req, servername, server, isreliable, long_reordering)
+        else:
+            ms = self.rand.randint(0, 7000) if self.longDelays else self.rand.randint(0, 100)
+            self.scheduler.call_later(ms / 1000, req.replyCh.put, ReplyMsg(False, None), req=req)
 
-            def dispatch():
-                r = server.dispatch(req)
-                ech.put(r)
+    def deliver(self, req, servername, server, isreliable, long_reordering):
+        # runs on a worker, calls the handler and sends back the reply
+        with self.mu:
+            call = self.add_inflight(req, servername, server)
+        if call is None:
+            req.replyCh.put(ReplyMsg(False, None))
+            return
 
-            threading.Thread(target=dispatch, daemon=True).start()
+        reply = server.dispatch(req)
 
-            reply = None
-            reply_ok = False
-            server_dead = False
+        with self.mu:
+            server_dead = not self.remove_inflight(call)
+
+        if server_dead:
+            pass
+        elif not isreliable and self.rand.randint(0, 999) < 100:
+            req.replyCh.put(ReplyMsg(False, None))
+        elif long_reordering and self.rand.randint(0, 899) < 600:
+            ms = 200 + self.rand.randint(0, 2000)
+            self.scheduler.call_later(ms / 1000, req.replyCh.put, reply, req=req)
+        else:
+            req.replyCh.put(reply)
 
-            while not reply_ok and not server_dead:
-                try:
-                    reply = ech.get(timeout=0.1)
-                    reply_ok = True
-                except queue.Empty:
-                    server_dead = self.is_server_dead(req.endname, servername, server)
+    def get_queue_depth(self):
+        # requests waiting to be picked up, either by an ingress thread or by a worker
+        # (requests that are being delayed are not counted, see get_delayed_count)
+        return sum(i.ch.qsize() for i in self.ingress) + self.pool.queue_depth()
 
-            if not reply_ok or server_dead:
-                req.replyCh.put(ReplyMsg(False, None))
-            elif not isreliable and random.randint(0, 999) < 100:
-                req.replyCh.put(ReplyMsg(False, None))
-            elif long_reordering and random.randint(0, 899) < 600:
-                ms = 200 + random.randint(0, 2000)
-                threading.Timer(ms / 1000, lambda: req.replyCh.put(reply)).start()
-            else:
-                req.replyCh.put(reply)
-        else:
-            ms = random.randint(0, 7000) if self.longDelays else random.randint(0, 100)
-            threading.Timer(ms / 1000, lambda: req.replyCh.put(ReplyMsg(False, None))).start()
+    def get_delayed_count(self):
+        # requests and replies held back by the simulated delays
+        return self.scheduler.pending()
 
     def make_end(self, endname):
         with self.mu:
@@ -168,14 +747,18 @@ class Network:
             del self.ends[endname]
             del self.enabled[endname]
             del self.connections[endname]
+            self.fail_inflight(self.inflight_ends.get(endname, {}).values())
 
     def add_server(self, servername, server):
         with self.mu:
             self.servers[servername] = server
+            # calls still running on a server that was replaced
+            self.fail_inflight(c for c in self.inflight_servers.get(servername, {}).values() if c.server != server)
 
     def delete_server(self, servername):
         with self.mu:
             self.servers[servername] = None
+            self.fail_inflight(self.inflight_servers.get(servername, {}).values())
 
     def connect(self, endname, servername):
         with self.mu:
@@ -184,6 +767,8 @@ class Network:
     def enable(self, endname, enabled):
         with self.mu:
             self.enabled[endname] = enabled
+            if not enabled:
+                self.fail_inflight(self.inflight_ends.get(endname, {}).values())
 
     def get_count(self, servername):
         with self.mu:
@@ -191,31 +776,49 @@ class Network:
         return server.get_count() if server else 0
 
     def get_total_count(self):
-        return self.count
+        return sum(i.count for i in self.ingress)
 
     def get_total_bytes(self):
-        return self.bytes
+        return sum(i.bytes for i in self.ingress)
 
 class Server:
     def __init__(self):
         self.mu = threading.Lock()
         self.services = {}
-        self.count = 0
+        # "Service.Method" -> handler(req), resolved once in add_service so
+        # dispatch is one dict lookup. replaced as a whole (never modified)
+        # so dispatch can read it without the lock
+        self.handlers = {}
+        # same for invoker(decoded args), used for batches
+        self.invokers = {}
+        # next() on an itertools.count is atomic, so counting calls doesn't
+        # need a lock either (see get_count)
+        self.calls = itertools.count()
+        self.peeks = 0
 
     def add_service(self, svc):
         with self.mu:
             self.services[svc.name] = svc
+            handlers = dict(self.handlers)
+            invokers = dict(self.invokers)
+            for method_name in svc.methods:
+                handlers[f"{svc.name}.{method_name}"] = svc.handler(method_name)
+                invokers[f"{svc.name}.{method_name}"] = svc.invoker(method_name)
+            self.handlers = handlers
+            self.invokers = invokers
 
     def dispatch(self, req):
-        with self.mu:
-            self.count += 1
-
-            dot = req.svcMeth.rindex('.')
-            service_name = req.svcMeth[:dot]
-            method_name = req.svcMeth[dot + 1:]
-
-            service = self.services.get(service_name)
-
+        if req.svcMeth == BATCH:
+            return self.dispatch_batch(req)
+        next(self.calls)
+        handler = self.handlers.get(req.svcMeth)
+        if handler is not None:
+            return handler(req)
+
+        dot = req.svcMeth.rindex('.')
+        service_name = req.svcMeth[:dot]
+        method_name = req.svcMeth[dot + 1:]
+        service = self.services.get(service_name)
         if service:
             return service.dispatch(method_name, req)
         else:
@@ -223,9 +826,35 @@ class Server:
             logging.fatal(f"labrpc.Server.dispatch(): unknown service {service_name} in {req.svcMeth}; expecting one of {choices}")
             return ReplyMsg(False, None)
 
+    def dispatch_batch(self, req):
+        # runs the calls of a batch in order, every one counts as a call
+        # the replies are encoded one by one, so callers decode them as
+        # usual, their buffers go in order into the buffers of the reply
+        methods, calls = pickle.loads(req.args)
+        invokers = self.invokers
+        results = []
+        buffers = []
+        for i, data, bufs in split_buffers(calls, req.buffers):
+            next(self.calls)
+            args = decode(data, bufs)
+            invoke = invokers.get(methods[i])
+            if invoke is None:
+                logging.fatal(f"labrpc.Server.dispatch_batch(): unknown method {methods[i]}")
+                results.append((False, None, 0))
+                continue
+            rep = invoke(args)
+            results.append((rep.ok, rep.reply, len(rep.buffers) if rep.buffers else 0))
+            if rep.buffers:
+                buffers.extend(rep.buffers)
+        return ReplyMsg(True, pickle.dumps(results), buffers or None)
+
     def get_count(self):
+        # itertools.count can't be read without advancing it, so take a
+        # number and subtract the ones taken by earlier get_count()s
         with self.mu:
-            return self.count
+            n = next(self.calls) - self.peeks
+            self.peeks += 1
+            return n
 
 class Service:
     def __init__(self, rcvr):
@@ -233,29 +862,44 @@ class Service:
         self.rcvr = rcvr
         self.methods = {}
 
-        for method_name in dir(rcvr):
-            if method_name.startswith('_'):
-                continue
+        # a receiver can list its RPC handlers in rpc_methods, otherwise
+        # every public method is one (which includes helpers like
+        # KVServer.shard_id that were never meant to be called remotely)
+        names = getattr(rcvr, "rpc_methods", None)
+        if names is None:
+            names = [name for name in dir(rcvr) if not name.startswith('_')]
+        for method_name in names:
             method = getattr(rcvr, method_name)
             if callable(method):
                 self.methods[method_name] = method
 
-    def dispatch(self, methname, req):
-        method = self.methods.get(methname)
-        if method:
-            # decode the argument.
-            args = LabDecoder(io.BytesIO(req.args)).decode()
+    def invoker(self, methname):
+        # invoke(args) -> ReplyMsg for one method, args already decoded
+        method = self.methods[methname]
 
+        def invoke(args):
             # call the method
             replyv = method(args)
 
             # encode the reply
-            rb = io.BytesIO()
-            LabEncoder(rb).encode(replyv)
-            reply = rb.getvalue()
-            return ReplyMsg(True, reply)
+            reply, buffers = encode(replyv)
+            return ReplyMsg(True, reply, buffers)
+        return invoke
+
+    def handler(self, methname):
+        # handler(req) -> ReplyMsg for one method, what Server.dispatch calls
+        invoke = self.invoker(methname)
+
+        def handle(req):
+            # decode the argument.
+            args = decode(req.args, req.buffers)
+            return invoke(args)
+        return handle
+
+    def dispatch(self, methname, req):
+        if methname in self.methods:
+            return self.handler(methname)(req)
         else:
             choices = list(self.methods.keys())
             logging.fatal(f"labrpc.Service.dispatch(): unknown method {methname} in {req.svcMeth}; expecting one of {choices}")
             return ReplyMsg(False, None)
-
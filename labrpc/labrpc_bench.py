@@ -0,0 +1,226 @@
+import asyncio
+import queue
+import sys
+import threading
+import time
+import tracemalloc
+
+from labrpc.labrpc import Network, Service, Server, ReplyFuture
+from labrpc.transport import SocketNetwork
+
+# labrpc throughput benchmarks
+#
+#   python -m labrpc.labrpc_bench
+
+class EchoServer:
+    def echo(self, args):
+        return args
+
+def make_network(nworkers, reliable=True, ningress=4):
+    rn = Network(nworkers=nworkers, ningress=ningress)
+    rn.reliable(reliable)
+    rs = Server()
+    rs.add_service(Service(EchoServer()))
+    rn.add_server("server", rs)
+    return rn
+
+def make_socket_network():
+    rn = SocketNetwork()
+    rs = Server()
+    rs.add_service(Service(EchoServer()))
+    rn.add_server("server", rs)
+    return rn
+
+def run_clients(rn, nclients, duration):
+    # nclients threads calling as fast as they can for duration seconds
+    # returns (ops/s, peak number of threads in the process)
+    done = threading.Event()
+    counts = [0] * nclients
+
+    def client(i):
+        e = rn.make_end(f"end-{i}")
+        rn.connect(f"end-{i}", "server")
+        rn.enable(f"end-{i}", True)
+        n = 0
+        while not done.is_set():
+            try:
+                e.call("EchoServer.echo", i)
+            except TimeoutError:
+                pass
+            n += 1
+        counts[i] = n
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(nclients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    peak = 0
+    while time.perf_counter() - start < duration:
+        peak = max(peak, threading.active_count())
+        time.sleep(0.005)
+    done.set()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.perf_counter() - start), peak
+
+def bench_dispatch(duration):
+    # worker pool vs one new thread per request (nworkers=0)
+    print("dispatch: worker pool vs thread per request")
+    print(f"{'clients':>8} {'reliable':>9} {'per-request ops/s':>18} {'threads':>8} {'pool ops/s':>11} {'threads':>8}")
+    for reliable in [True, False]:
+        for nclients in [1, 8, 64]:
+            results = []
+            for nworkers in [0, 64]:
+                rn = make_network(nworkers, reliable)
+                try:
+                    results.append(run_clients(rn, nclients, duration))
+                finally:
+                    rn.cleanup()
+            (ops0, threads0), (ops1, threads1) = results
+            print(f"{nclients:>8} {str(reliable):>9} {ops0:>18.0f} {threads0:>8} {ops1:>11.0f} {threads1:>8}")
+
+def bench_delays(ncalls):
+    # many calls to a disabled end under long delays: each one waits up to
+    # 7s for its failure. they should cost heap entries, not threads
+    print(f"delays: {ncalls} outstanding calls to a disabled end")
+    rn = make_network(64)
+    try:
+        rn.long_delays(True)
+        e = rn.make_end("dead")
+        rn.connect("dead", "server")
+        threads0 = threading.active_count()
+
+        async def calls():
+            tasks = [asyncio.ensure_future(e.call_async("EchoServer.echo", i)) for i in range(ncalls)]
+            await asyncio.sleep(0.5)
+            print(f"  after 0.5s: {rn.get_delayed_count()} delayed, {threading.active_count() - threads0} extra threads")
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            return sum(1 for r in results if isinstance(r, TimeoutError))
+
+        start = time.perf_counter()
+        failed = asyncio.run(calls())
+        print(f"  {failed} calls failed after {time.perf_counter() - start:.1f}s")
+    finally:
+        rn.cleanup()
+
+def bench_reply_channels(nrpcs):
+    # per-call cost of the reply channel: queue.Queue (what ReqMsg used to
+    # allocate) vs ReplyFuture
+    print("reply channels: queue.Queue vs ReplyFuture")
+    n = 10000
+    for name, make in [("queue.Queue", queue.Queue), ("ReplyFuture", ReplyFuture)]:
+        tracemalloc.start()
+        chans = [make() for _ in range(n)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del chans
+
+        start = time.perf_counter()
+        for _ in range(n):
+            ch = make()
+            ch.put(1)
+            ch.get()
+        t = (time.perf_counter() - start) / n
+        print(f"  {name:>12}: {size / n:6.0f} bytes/call allocated, {t * 1e6:5.2f} us create+put+get")
+
+    # labrpc_test.test_concurrent_many workload, 20 clients, scaled up
+    rn = make_network(64)
+    try:
+        nclients = 20
+        for name, make in [("queue.Queue", queue.Queue), ("ReplyFuture", ReplyFuture)]:
+            latencies = []
+            mu = threading.Lock()
+
+            def client(i):
+                e = rn.make_end(f"{name}-{i}")
+                rn.connect(f"{name}-{i}", "server")
+                rn.enable(f"{name}-{i}", True)
+                mine = []
+                for j in range(nrpcs):
+                    start = time.perf_counter()
+                    req = e.send("EchoServer.echo", i * 100 + j, make())
+                    e.decode_reply(req.replyCh.get())
+                    mine.append(time.perf_counter() - start)
+                with mu:
+                    latencies.extend(mine)
+
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(nclients)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+            print(f"  concurrent_many {name:>12}: {len(latencies) / elapsed:7.0f} calls/s, "
+                  f"p50 {latencies[len(latencies) // 2] * 1e6:6.0f} us, p99 {latencies[int(len(latencies) * 0.99)] * 1e6:6.0f} us")
+    finally:
+        rn.cleanup()
+
+def bench_ingress(duration):
+    # one shared request queue and consumer vs several
+    print("ingress: number of request queues")
+    print(f"{'clients':>8} {'reliable':>9} {'1 queue ops/s':>14} {'4 queues ops/s':>15} {'8 queues ops/s':>15}")
+    for reliable in [True, False]:
+        for nclients in [8, 64, 256]:
+            results = []
+            for ningress in [1, 4, 8]:
+                rn = make_network(64, reliable, ningress)
+                try:
+                    results.append(run_clients(rn, nclients, duration)[0])
+                finally:
+                    rn.cleanup()
+            print(f"{nclients:>8} {str(reliable):>9} {results[0]:>14.0f} {results[1]:>15.0f} {results[2]:>15.0f}")
+
+def bench_transport(duration):
+    # in-memory network vs real TCP on 127.0.0.1 (framing, syscalls, and a
+    # reader thread on each side)
+    print("transport: in-memory vs loopback TCP")
+    print(f"{'clients':>8} {'memory ops/s':>13} {'tcp ops/s':>10}")
+    for nclients in [1, 8, 64]:
+        results = []
+        for make in [lambda: make_network(64), make_socket_network]:
+            rn = make()
+            try:
+                results.append(run_clients(rn, nclients, duration)[0])
+            finally:
+                rn.cleanup()
+        print(f"{nclients:>8} {results[0]:>13.0f} {results[1]:>10.0f}")
+
+def bench_batching(ncalls):
+    # many concurrent calls from one end, one request per call vs batches
+    print(f"batching: {ncalls} concurrent calls on one end")
+    print(f"{'window':>8} {'calls/s':>8} {'requests':>9} {'bytes':>9}")
+    for window in [None, 0.001, 0.005]:
+        rn = make_network(64)
+        try:
+            rn.batching(window)
+            e = rn.make_end("end")
+            rn.connect("end", "server")
+            rn.enable("end", True)
+
+            async def calls():
+                sem = asyncio.Semaphore(256) # calls outstanding at a time
+                async def call(i):
+                    async with sem:
+                        return await e.call_async("EchoServer.echo", i)
+                await asyncio.gather(*[call(i) for i in range(ncalls)])
+
+            start = time.perf_counter()
+            asyncio.run(calls())
+            elapsed = time.perf_counter() - start
+            print(f"{str(window):>8} {ncalls / elapsed:>8.0f} {rn.get_total_count():>9} {rn.get_total_bytes():>9}")
+        finally:
+            rn.cleanup()
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    bench_dispatch(duration)
+    bench_delays(5000)
+    bench_reply_channels(500)
+    bench_ingress(duration)
+    bench_transport(duration)
+    bench_batching(20000)
+
+if __name__ == "__main__":
+    main()
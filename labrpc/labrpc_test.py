@@ -1,3 +1,5 @@
+import asyncio
+import os
 import threading
 import time
 import unittest
@@ -285,3 +287,344 @@ class TestUnreliable(unittest.TestCase):
         n = rn.get_count(1000)
         self.assertEqual(n, total, f"wrong get_count() {n}, expected {total}")
 
+
+class TestAsync(unittest.TestCase):
+    def test_async(self):
+        rn = Network()
+        self.addCleanup(rn.cleanup)
+
+        js = JunkServer()
+        svc = Service(js)
+
+        rs = Server()
+        rs.add_service(svc)
+        rn.add_server("server99", rs)
+
+        e = rn.make_end("end1-99")
+        rn.connect("end1-99", "server99")
+        rn.enable("end1-99", True)
+
+        async def many():
+            # all calls are outstanding at the same time from one thread
+            return await asyncio.gather(*[e.call_async("JunkServer.handler2", i) for i in range(50)])
+
+        replies = asyncio.run(many())
+        for i, reply in enumerate(replies):
+            self.assertEqual(reply[0], f"handler2-{i}", "wrong reply from handler2")
+
+        n = rn.get_count("server99")
+        self.assertEqual(n, 50, f"wrong get_count() {n}, expected 50")
+
+    def test_async_timeout(self):
+        rn = Network()
+        self.addCleanup(rn.cleanup)
+        rn.long_delays(True)
+
+        e = rn.make_end("end1-99")
+        rn.connect("end1-99", "server99") # no such server, so it fails slowly
+
+        async def call():
+            return await e.call_async("JunkServer.handler2", 1, timeout=0.1)
+
+        start = time.time()
+        with self.assertRaises(TimeoutError):
+            asyncio.run(call())
+        self.assertLess(time.time() - start, 1.0)
+
+# a call whose handler is still running should fail as soon as its end
+# is disabled or its server is deleted, not some time later
+class TestKilled(unittest.TestCase):
+    def test_killed(self):
+        for kill in ["disable", "delete"]:
+            rn = Network()
+            self.addCleanup(rn.cleanup)
+
+            js = JunkServer()
+            svc = Service(js)
+
+            rs = Server()
+            rs.add_service(svc)
+            rn.add_server("server99", rs)
+
+            e = rn.make_end("end1-99")
+            rn.connect("end1-99", "server99")
+            rn.enable("end1-99", True)
+
+            result = []
+            def call():
+                start = time.time()
+                try:
+                    e.call("JunkServer.handler3", 99) # sleeps for 20 seconds
+                    result.append(("reply", 0))
+                except TimeoutError:
+                    result.append(("timeout", time.time() - start))
+
+            t = threading.Thread(target=call)
+            t.start()
+            time.sleep(0.2)
+            killed = time.time()
+            if kill == "disable":
+                rn.enable("end1-99", False)
+            else:
+                rn.delete_server("server99")
+            t.join(5)
+
+            self.assertEqual(len(result), 1, f"{kill}: call did not return")
+            self.assertEqual(result[0][0], "timeout", f"{kill}: expected the call to fail")
+            self.assertLess(time.time() - killed, 0.05, f"{kill}: call took too long to fail")
+
+class TestCleanup(unittest.TestCase):
+    def test_cleanup(self):
+        # calls waiting for a delayed reply fail when the network goes away,
+        # and so do calls made after that
+        rn = Network()
+        rn.long_delays(True)
+        e = rn.make_end("end1-99")  # never enabled, so the failure is delayed
+
+        result = []
+        def call():
+            try:
+                e.call("JunkServer.handler2", 111)
+                result.append("reply")
+            except TimeoutError:
+                result.append("timeout")
+
+        t = threading.Thread(target=call)
+        t.start()
+        time.sleep(0.05)
+        cleaned = time.time()
+        rn.cleanup()
+        t.join(5)
+
+        self.assertEqual(result, ["timeout"])
+        self.assertLess(time.time() - cleaned, 0.5)
+        with self.assertRaises(TimeoutError):
+            e.call("JunkServer.handler2", 111, timeout=5)
+
+class TestReplyFuture(unittest.TestCase):
+    def test_reply_future(self):
+        f = ReplyFuture()
+        with self.assertRaises(TimeoutError):
+            f.get(timeout=0.01)
+
+        got = []
+        f.add_done_callback(got.append)
+        threading.Timer(0.05, f.put, args=("a",)).start()
+        self.assertEqual(f.get(), "a")
+        self.assertEqual(f.get(), "a")
+        self.assertEqual(got, ["a"])
+
+        # only the first value counts
+        self.assertFalse(f.put("b"))
+        self.assertEqual(f.get(), "a")
+
+        # callbacks added afterwards run right away
+        f.add_done_callback(got.append)
+        self.assertEqual(got, ["a", "a"])
+
+class TestSimulator(unittest.TestCase):
+    def run_sim(self, seed):
+        sim = Simulator(seed)
+        rn = Network(sim=sim)
+        rn.reliable(False)
+        rn.long_reordering(True)
+
+        js = JunkServer()
+        svc = Service(js)
+        rs = Server()
+        rs.add_service(svc)
+        rn.add_server("server99", rs)
+
+        e = rn.make_end("end1-99")
+        rn.connect("end1-99", "server99")
+        rn.enable("end1-99", True)
+
+        outcomes = []
+        for i in range(300):
+            try:
+                reply = e.call("JunkServer.handler1", str(i))
+                outcomes.append((i, reply[0], sim.now()))
+            except TimeoutError:
+                outcomes.append((i, None, sim.now()))
+        rn.cleanup()
+        return outcomes
+
+    def test_simulator(self):
+        start = time.time()
+        a = self.run_sim(1)
+        b = self.run_sim(1)
+        c = self.run_sim(2)
+
+        # same seed, same drops and delays at the same simulated times
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+        self.assertTrue(any(reply is None for _, reply, _ in a))
+        self.assertTrue(all(reply in (None, i) for i, reply, _ in a))
+        # lots of simulated seconds of reordering delays, very little real time
+        self.assertGreater(a[-1][2], 10)
+        self.assertLess(time.time() - start, 5)
+
+    def test_simulator_disabled(self):
+        sim = Simulator(7)
+        rn = Network(sim=sim)
+        rn.long_delays(True)
+
+        rs = Server()
+        rs.add_service(Service(JunkServer()))
+        rn.add_server("server99", rs)
+        e = rn.make_end("end1-99")
+        rn.connect("end1-99", "server99")
+
+        for _ in range(20):
+            with self.assertRaises(TimeoutError):
+                e.call("JunkServer.handler2", 1)
+        self.assertGreater(sim.now(), 1)
+
+        # timeouts are in simulated time too
+        rn.enable("end1-99", True)
+        rn.enable("end1-99", False)
+        before = sim.now()
+        with self.assertRaises(TimeoutError):
+            e.call("JunkServer.handler2", 1, timeout=0.001)
+        self.assertAlmostEqual(sim.now() - before, 0.001)
+
+class RestrictedServer(JunkServer):
+    rpc_methods = ["handler2"]
+
+class TestRpcMethods(unittest.TestCase):
+    def test_rpc_methods(self):
+        rn = Network()
+        self.addCleanup(rn.cleanup)
+
+        svc = Service(RestrictedServer())
+        self.assertEqual(list(svc.methods), ["handler2"])
+
+        rs = Server()
+        rs.add_service(svc)
+        rn.add_server(99, rs)
+        e = rn.make_end("end1-99")
+        rn.connect("end1-99", 99)
+        rn.enable("end1-99", True)
+
+        self.assertEqual(e.call("RestrictedServer.handler2", 5)[0], "handler2-5")
+        with self.assertRaises(TimeoutError):
+            e.call("RestrictedServer.handler1", "5")
+
+        # counted without a lock, but none are lost
+        def client():
+            for i in range(200):
+                e.call("RestrictedServer.handler2", i)
+        threads = [threading.Thread(target=client) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(rs.get_count(), 2 + 8 * 200)
+        self.assertEqual(rs.get_count(), 2 + 8 * 200)
+
+class TestBatching(unittest.TestCase):
+    def test_batching(self):
+        rn = Network()
+        self.addCleanup(rn.cleanup)
+        rn.batching(0.01)
+
+        rs = Server()
+        rs.add_service(Service(JunkServer()))
+        rn.add_server(99, rs)
+        e = rn.make_end("end1-99")
+        rn.connect("end1-99", 99)
+        rn.enable("end1-99", True)
+
+        async def calls(n):
+            return await asyncio.gather(*[e.call_async("JunkServer.handler2", i) for i in range(n)],
+                                        return_exceptions=True)
+
+        replies = asyncio.run(calls(100))
+        self.assertEqual([r[0] for r in replies], [f"handler2-{i}" for i in range(100)])
+        # 64 per batch at most
+        self.assertEqual(rn.get_total_count(), 2)
+        self.assertEqual(rs.get_count(), 100)
+
+        # objects in a batch are encoded by labgob like any other call
+        async def objects():
+            return await asyncio.gather(e.call_async("JunkServer.handler4", JunkArgs(1)),
+                                        e.call_async("JunkServer.handler2", 5))
+        reply4, reply2 = asyncio.run(objects())
+        self.assertIsInstance(reply4, JunkReply)
+        self.assertEqual(reply4.x, "pointer")
+        self.assertEqual(reply2[0], "handler2-5")
+
+        # a lone call still goes out after the window
+        self.assertEqual(e.call("JunkServer.handler2", 7)[0], "handler2-7")
+        with self.assertRaises(TimeoutError):
+            e.call("JunkServer.nosuchhandler", 7)
+
+        # arguments that can't be encoded raise in the caller, like they do
+        # without batching, and the rest of the batch goes out
+        async def bad():
+            return await asyncio.gather(e.call_async("JunkServer.handler2", lambda: 1),
+                                        e.call_async("JunkServer.handler2", 8),
+                                        return_exceptions=True)
+        bad_reply, reply = asyncio.run(bad())
+        self.assertIsInstance(bad_reply, Exception)
+        self.assertNotIsInstance(bad_reply, TimeoutError)
+        self.assertEqual(reply[0], "handler2-8")
+
+        # a batch is dropped as a whole
+        rn.reliable(False)
+        for _ in range(10):
+            results = asyncio.run(calls(20))
+            failed = sum(1 for r in results if isinstance(r, TimeoutError))
+            self.assertIn(failed, (0, 20))
+
+        rn.enable("end1-99", False)
+        results = asyncio.run(calls(20))
+        self.assertTrue(all(isinstance(r, TimeoutError) for r in results))
+
+class BlobServer:
+    def __init__(self):
+        self.got = None
+
+    def Echo(self, args):
+        self.got = args
+        return args
+
+# big binary values are handed over, not copied
+class TestBuffers(unittest.TestCase):
+    def test_buffers(self):
+        rn = Network()
+        self.addCleanup(rn.cleanup)
+        bs = BlobServer()
+        rs = Server()
+        rs.add_service(Service(bs))
+        rn.add_server(99, rs)
+        e = rn.make_end("end1-99")
+        rn.connect("end1-99", 99)
+        rn.enable("end1-99", True)
+
+        big = os.urandom(1 << 20)
+        reply = e.call("BlobServer.Echo", [big, b"small"])
+        self.assertIs(bs.got[0], big)
+        self.assertIs(reply[0], big)
+        self.assertEqual(reply[1], b"small")
+        self.assertGreaterEqual(rn.get_total_bytes(), 1 << 20)
+
+        # memoryviews can't be pickled, they always go out of band
+        view = memoryview(big)[:10]
+        self.assertEqual(e.call("BlobServer.Echo", view), big[:10])
+        self.assertEqual(e.call("BlobServer.Echo", [[view]]), [[big[:10]]])
+
+        # messages without big values don't need the out-of-band path
+        self.assertIsNone(encode([b"small", "x" * 100])[1])
+        self.assertIsNotNone(encode(JunkArgs([big]))[1])
+
+        # mutable buffers are copied, the server must not see later changes
+        buf = bytearray(big)
+        e.call("BlobServer.Echo", buf)
+        buf[:5] = b"XXXXX"
+        self.assertEqual(bs.got, big)
+        self.assertIs(type(bs.got), bytes)
+
+        # batches carry them out of band too
+        rn.batching(0.001)
+        self.assertIs(e.call("BlobServer.Echo", [big])[0], big)
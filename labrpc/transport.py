@@ -0,0 +1,451 @@
+import itertools
+import logging
+import random
+import socket
+import struct
+import threading
+
+from labrpc.labrpc import ClientEnd, ReqMsg, ReplyMsg, WorkerPool, REAL_CLOCK, encode, msg_size
+
+# real TCP transport for labrpc, so servers can live in other processes and
+# the cost of serialization and the network can actually be measured
+# same API as the in-memory network: Server/Service on one side, ClientEnd
+# call()/call_async() on the other, and SocketNetwork has the make_end /
+# connect / enable / add_server calls that config.py uses
+#
+# every message is one frame: 4 byte big-endian length, then the body
+#   request: seq (8 bytes), length of svcMeth (2 bytes), number of buffers
+#            (2 bytes), svcMeth, length of every buffer (8 bytes each),
+#            args, buffers
+#   reply:   seq (8 bytes), ok (1 byte), number of buffers (2 bytes),
+#            length of every buffer, reply, buffers
+# args and reply are the labgob encoded bytes, same as in ReqMsg/ReplyMsg,
+# and the buffers are their out-of-band values (see labgob OOB_THRESHOLD).
+# buffers are written straight from the objects and read into objects of
+# their own, so a big value is never copied into or out of a frame
+# all ends talking to one server share one connection and can have any
+# number of calls outstanding on it, replies come back in any order and are
+# matched to their call by seq
+
+LENGTH = struct.Struct(">I")
+REQUEST = struct.Struct(">QHH")
+REPLY = struct.Struct(">QBH")
+BUFLEN = struct.Struct(">Q")
+
+MAX_FRAME = 1 << 31
+
+# seconds to wait for a server to accept a connection, a call to a server
+# that doesn't answer fails after this instead of hanging in connect
+CONNECT_TIMEOUT = 5.0
+
+def read_exact(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError()
+    return data
+
+def read_buffers(f, nbufs, rest):
+    # (encoded message, buffers) of the rest of a frame
+    lengths = [BUFLEN.unpack(read_exact(f, BUFLEN.size))[0] for _ in range(nbufs)]
+    data = read_exact(f, rest - BUFLEN.size * nbufs - sum(lengths))
+    buffers = [read_exact(f, n) for n in lengths]
+    return data, buffers or None
+
+def read_length(f):
+    # length of the next frame, None at the end of the stream
+    header = f.read(LENGTH.size)
+    if len(header) < LENGTH.size:
+        return None
+    n, = LENGTH.unpack(header)
+    if n > MAX_FRAME:
+        raise ConnectionError(f"labrpc: frame of {n} bytes")
+    return n
+
+def read_request(f):
+    # (seq, svcMeth, args, buffers), None at the end of the stream
+    n = read_length(f)
+    if n is None:
+        return None
+    seq, methlen, nbufs = REQUEST.unpack(read_exact(f, REQUEST.size))
+    svcMeth = read_exact(f, methlen).decode()
+    args, buffers = read_buffers(f, nbufs, n - REQUEST.size - methlen)
+    return seq, svcMeth, args, buffers
+
+def read_reply(f):
+    # (seq, ReplyMsg), None at the end of the stream
+    n = read_length(f)
+    if n is None:
+        return None
+    seq, ok, nbufs = REPLY.unpack(read_exact(f, REPLY.size))
+    reply, buffers = read_buffers(f, nbufs, n - REPLY.size)
+    return seq, ReplyMsg(ok == 1, reply if ok else None, buffers)
+
+def frame_parts(header, prefix, data, buffers):
+    # the frame as a list of byte strings to write one after the other
+    buffers = [memoryview(b).cast("B") for b in buffers] if buffers else []
+    lengths = [BUFLEN.pack(b.nbytes) for b in buffers]
+    n = len(header) + len(prefix) + sum(len(l) for l in lengths) + len(data) + sum(b.nbytes for b in buffers)
+    return [b"".join([LENGTH.pack(n), header, prefix] + lengths + [data])] + buffers
+
+def request_parts(seq, svcMeth, args, buffers):
+    meth = svcMeth.encode()
+    return frame_parts(REQUEST.pack(seq, len(meth), len(buffers or ())), meth, args, buffers)
+
+def reply_parts(seq, rep):
+    if not rep.ok:
+        return frame_parts(REPLY.pack(seq, 0, 0), b"", b"", None)
+    return frame_parts(REPLY.pack(seq, 1, len(rep.buffers or ())), b"", rep.reply, rep.buffers)
+
+def send_parts(sock, parts):
+    # caller holds the connection's write lock
+    for part in parts:
+        sock.sendall(part)
+
+def tune(sock):
+    # RPCs are small and latency bound, don't let Nagle hold them back
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+# serves a labrpc Server on a TCP port
+# one reader thread per connection, handlers run on a worker pool so a slow
+# handler doesn't hold up the other calls on the same connection
+class SocketServer:
+    def __init__(self, server, host="127.0.0.1", port=0, nworkers=32):
+        self.server = server
+        self.pool = WorkerPool(nworkers)
+        self.mu = threading.Lock()
+        self.conns = set()
+        self.closed = False
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(128)
+        self.address = self.listener.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return  # closed
+            tune(sock)
+            with self.mu:
+                if self.closed:
+                    sock.close()
+                    return
+                self.conns.add(sock)
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        wmu = threading.Lock()  # one writer at a time, frames must not interleave
+        f = sock.makefile("rb")
+        try:
+            while True:
+                msg = read_request(f)
+                if msg is None:
+                    break
+                self.pool.submit(self._handle, sock, wmu, *msg)
+        except (OSError, ValueError, EOFError):
+            pass
+        finally:
+            with self.mu:
+                self.conns.discard(sock)
+            sock.close()
+
+    def _handle(self, sock, wmu, seq, svcMeth, args, buffers):
+        req = ReqMsg(None, svcMeth, None, args, buffers=buffers)
+        try:
+            rep = self.server.dispatch(req)
+        except Exception:
+            logging.exception(f"labrpc: {svcMeth} failed")
+            rep = ReplyMsg(False, None)
+        parts = reply_parts(seq, rep)
+        try:
+            with wmu:
+                send_parts(sock, parts)
+        except OSError:
+            pass  # the client went away, nobody is waiting for this reply
+
+    def close(self):
+        with self.mu:
+            self.closed = True
+            conns = list(self.conns)
+            self.conns.clear()
+        self.listener.close()
+        for sock in conns:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self.pool.shutdown()
+
+# one client connection to a server, shared by all the ends that talk to it
+class Connection:
+    def __init__(self, address):
+        self.sock = socket.create_connection(address, CONNECT_TIMEOUT)
+        self.sock.settimeout(None)  # only for connecting, calls have their own
+        tune(self.sock)
+        self.wmu = threading.Lock()
+        self.mu = threading.Lock()
+        self.pending = {}  # seq -> (endname, ReplyFuture)
+        self.seq = itertools.count()
+        self.dead = False
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def send(self, endname, svcMeth, args, buffers, replyCh):
+        # returns the seq of the call, or None if the connection is broken
+        seq = next(self.seq)
+        with self.mu:
+            if self.dead:
+                return None
+            self.pending[seq] = (endname, replyCh)
+        parts = request_parts(seq, svcMeth, args, buffers)
+        try:
+            with self.wmu:
+                send_parts(self.sock, parts)
+        except OSError:
+            self.fail_all()
+            return None
+        return seq
+
+    def forget(self, seq):
+        with self.mu:
+            self.pending.pop(seq, None)
+
+    def _read(self):
+        f = self.sock.makefile("rb")
+        try:
+            while True:
+                msg = read_reply(f)
+                if msg is None:
+                    break
+                seq, rep = msg
+                with self.mu:
+                    entry = self.pending.pop(seq, None)
+                if entry is not None:
+                    entry[1].put(rep)
+        except (OSError, ValueError, EOFError):
+            pass
+        self.fail_all()
+
+    def fail_end(self, endname):
+        # fails the calls of one end, for SocketNetwork.enable(end, False)
+        with self.mu:
+            calls = [seq for seq, entry in self.pending.items() if entry[0] == endname]
+            failed = [self.pending.pop(seq)[1] for seq in calls]
+        for replyCh in failed:
+            replyCh.put(ReplyMsg(False, None))
+
+    def fail_all(self):
+        with self.mu:
+            self.dead = True
+            failed = list(self.pending.values())
+            self.pending.clear()
+        for _, replyCh in failed:
+            replyCh.put(ReplyMsg(False, None))
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+# ClientEnd over a Connection, call() and call_async() are the same as for
+# the in-memory network
+class SocketClientEnd(ClientEnd):
+    def __init__(self, endname, network):
+        self.endname = endname
+        self.network = network
+        self.done = network.done
+        self.sim = None
+
+    def send(self, svcMeth, args, replyCh=None):
+        return self.network.send(self.endname, svcMeth, args, replyCh)
+
+    def abandon(self, req):
+        # drop the pending entry, the reply is ignored if it still shows up
+        if req.conn is not None:
+            req.conn.forget(req.seq)
+
+# the parts of labrpc.Network that config.py uses, over real sockets
+# servers are either started here (add_server, on 127.0.0.1) or run
+# somewhere else and just registered by address (add_address)
+# there is no simulated unreliability: a disabled end fails its calls right
+# away, and the network is as reliable as the local TCP stack
+class SocketNetwork:
+    def __init__(self, host="127.0.0.1", nworkers=32):
+        self.mu = threading.Lock()
+        self.host = host
+        self.nworkers = nworkers
+        self.done = threading.Event()
+        self.sim = None
+        self.clock = REAL_CLOCK
+        self.rand = random.Random()
+        self.ends = {}         # endname -> SocketClientEnd
+        self.enabled = {}      # endname -> bool
+        self.connections = {}  # endname -> servername
+        self.servers = {}      # servername -> SocketServer, only the local ones
+        self.addresses = {}    # servername -> (host, port)
+        self.conns = {}        # servername -> Connection
+        self.connecting = {}   # servername -> Event, set once the connect is over
+        self.count = 0         # calls made, like the ingress counts of Network
+        self.bytes = 0
+
+    def cleanup(self):
+        self.done.set()
+        with self.mu:
+            servers = list(self.servers.values())
+            conns = list(self.conns.values())
+            self.servers.clear()
+            self.conns.clear()
+        for conn in conns:
+            conn.close()
+        for srv in servers:
+            srv.close()
+
+    # the options it can't simulate are refused with a ValueError, so a
+    # test doesn't silently run on a reliable network instead
+    def reliable(self, yes):
+        if not yes:
+            raise ValueError("labrpc: unreliable networks are not supported by SocketNetwork")
+
+    def long_reordering(self, yes):
+        if yes:
+            raise ValueError("labrpc: long reordering is not supported by SocketNetwork")
+
+    def long_delays(self, yes):
+        pass  # calls to disabled ends fail right away anyway
+
+    def make_end(self, endname):
+        with self.mu:
+            if endname in self.ends:
+                logging.fatal(f"MakeEnd: {endname} already exists")
+            e = SocketClientEnd(endname, self)
+            self.ends[endname] = e
+            self.enabled[endname] = False
+            self.connections[endname] = None
+        return e
+
+    def delete_end(self, endname):
+        with self.mu:
+            del self.ends[endname]
+            del self.enabled[endname]
+            del self.connections[endname]
+            conns = list(self.conns.values())
+        for conn in conns:
+            conn.fail_end(endname)
+
+    def add_server(self, servername, server):
+        # serves server on a free port of this machine
+        srv = SocketServer(server, self.host, 0, self.nworkers)
+        with self.mu:
+            old = self.servers.get(servername)
+            self.servers[servername] = srv
+        if old is not None:
+            old.close()
+        self.add_address(servername, srv.address)
+        return srv.address
+
+    def add_address(self, servername, address):
+        # a server that runs somewhere else (another process)
+        with self.mu:
+            self.addresses[servername] = tuple(address)
+            conn = self.conns.pop(servername, None)
+        if conn is not None:
+            conn.fail_all()
+
+    def delete_server(self, servername):
+        with self.mu:
+            srv = self.servers.pop(servername, None)
+            self.addresses.pop(servername, None)
+            conn = self.conns.pop(servername, None)
+        if conn is not None:
+            conn.fail_all()
+        if srv is not None:
+            srv.close()
+
+    def connect(self, endname, servername):
+        with self.mu:
+            self.connections[endname] = servername
+
+    def enable(self, endname, enabled):
+        with self.mu:
+            self.enabled[endname] = enabled
+            conns = list(self.conns.values())
+        if not enabled:
+            for conn in conns:
+                conn.fail_end(endname)
+
+    def connection(self, servername):
+        # the shared connection to servername, (re)connects if needed
+        # the connect runs without self.mu, so a server that doesn't answer
+        # only holds up the calls to that server. one caller connects, the
+        # others wait for it and take whatever it got
+        with self.mu:
+            conn = self.conns.get(servername)
+            if conn is not None and not conn.dead:
+                return conn
+            address = self.addresses.get(servername)
+            if address is None:
+                return None
+            connecting = self.connecting.get(servername)
+            if connecting is None:
+                self.connecting[servername] = threading.Event()
+        if connecting is not None:
+            connecting.wait(CONNECT_TIMEOUT)
+            with self.mu:
+                conn = self.conns.get(servername)
+            return conn if conn is not None and not conn.dead else None
+
+        try:
+            conn = Connection(address)
+        except OSError:
+            conn = None
+        with self.mu:
+            connecting = self.connecting.pop(servername)
+            stale = self.done.is_set() or self.addresses.get(servername) != address
+            if conn is not None and not stale:
+                self.conns[servername] = conn
+        connecting.set()
+        if conn is not None and stale:
+            # the server was deleted or moved while we were connecting
+            conn.fail_all()
+            return None
+        return conn
+
+    def send(self, endname, svcMeth, args, replyCh=None):
+        data, buffers = encode(args)
+        req = ReqMsg(endname, svcMeth, type(args), data, replyCh, buffers)
+        req.conn = None
+        req.seq = None
+
+        with self.mu:
+            self.count += 1
+            self.bytes += msg_size(req)
+            servername = self.connections[endname] if self.enabled.get(endname, False) else None
+        conn = self.connection(servername) if servername is not None else None
+        if conn is not None:
+            req.seq = conn.send(endname, svcMeth, req.args, req.buffers, req.replyCh)
+            if req.seq is not None:
+                req.conn = conn
+                return req
+        # disabled, or the server can't be reached
+        req.replyCh.put(ReplyMsg(False, None))
+        return req
+
+    def get_count(self, servername):
+        with self.mu:
+            srv = self.servers.get(servername)
+        return srv.server.get_count() if srv else 0
+
+    def get_total_count(self):
+        with self.mu:
+            return self.count
+
+    def get_total_bytes(self):
+        with self.mu:
+            return self.bytes
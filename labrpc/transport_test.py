@@ -0,0 +1,172 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+from labrpc.labrpc import Server, Service
+from labrpc.labrpc_test import JunkServer
+from labrpc import transport
+from labrpc.transport import SocketNetwork
+
+def make_network():
+    rn = SocketNetwork()
+    rs = Server()
+    rs.add_service(Service(JunkServer()))
+    rn.add_server("server99", rs)
+    e = rn.make_end("end1-99")
+    rn.connect("end1-99", "server99")
+    rn.enable("end1-99", True)
+    return rn, e
+
+class TestSocketBasic(unittest.TestCase):
+    def test_socket_basic(self):
+        rn, e = make_network()
+        try:
+            reply = e.call("JunkServer.handler2", 111)
+            self.assertEqual(reply[0], "handler2-111")
+            self.assertEqual(e.call("JunkServer.handler1", "9099")[0], 9099)
+            self.assertEqual(rn.get_count("server99"), 2)
+            self.assertEqual(rn.get_total_count(), 2)
+        finally:
+            rn.cleanup()
+
+# many threads and an event loop share one connection
+class TestSocketMultiplex(unittest.TestCase):
+    def test_socket_multiplex(self):
+        rn, e = make_network()
+        try:
+            errors = []
+
+            def client(i):
+                for j in range(50):
+                    n = i * 1000 + j
+                    if e.call("JunkServer.handler2", n)[0] != f"handler2-{n}":
+                        errors.append(n)
+
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(10)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(len(rn.conns), 1)
+
+            async def run():
+                return await asyncio.gather(*[e.call_async("JunkServer.handler2", i) for i in range(100)])
+            replies = asyncio.run(run())
+            self.assertEqual([r[0] for r in replies], [f"handler2-{i}" for i in range(100)])
+        finally:
+            rn.cleanup()
+
+class TestSocketFailures(unittest.TestCase):
+    def test_socket_failures(self):
+        rn, e = make_network()
+        try:
+            # a slow call fails as soon as the end is disabled
+            result = []
+
+            def call():
+                try:
+                    e.call("JunkServer.handler3", 99) # sleeps for 20 seconds
+                    result.append("reply")
+                except TimeoutError:
+                    result.append("timeout")
+
+            t = threading.Thread(target=call)
+            t.start()
+            time.sleep(0.2)
+            rn.enable("end1-99", False)
+            t.join(5)
+            self.assertEqual(result, ["timeout"])
+
+            with self.assertRaises(TimeoutError):
+                e.call("JunkServer.handler2", 1)
+
+            # options it can't simulate are refused
+            with self.assertRaises(ValueError):
+                rn.reliable(False)
+            with self.assertRaises(ValueError):
+                rn.long_reordering(True)
+            rn.reliable(True)
+
+            # a dead server fails the call instead of hanging
+            rn.enable("end1-99", True)
+            rn.delete_server("server99")
+            with self.assertRaises(TimeoutError):
+                e.call("JunkServer.handler2", 1)
+
+            # and a new one is picked up
+            rs = Server()
+            rs.add_service(Service(JunkServer()))
+            rn.add_server("server99", rs)
+            self.assertEqual(e.call("JunkServer.handler2", 2)[0], "handler2-2")
+
+            with self.assertRaises(TimeoutError):
+                e.call("JunkServer.handler3", 1, timeout=0.1)
+        finally:
+            rn.cleanup()
+
+class TestSocketConnect(unittest.TestCase):
+    def test_socket_connect(self):
+        # a server that doesn't accept the connection only holds up the
+        # calls to itself, and those fail after CONNECT_TIMEOUT
+        rn, e = make_network()
+        self.addCleanup(rn.cleanup)
+        rn.add_address("slow", ("slow.invalid", 1))
+        slow = rn.make_end("end1-slow")
+        rn.connect("end1-slow", "slow")
+        rn.enable("end1-slow", True)
+
+        create_connection = socket.create_connection
+        def connect(address, timeout=None, *args):
+            if address[0] == "slow.invalid":
+                time.sleep(timeout)
+                raise socket.timeout()
+            return create_connection(address, timeout, *args)
+
+        result = []
+        def call():
+            try:
+                slow.call("JunkServer.handler2", 1)
+                result.append("reply")
+            except TimeoutError:
+                result.append("timeout")
+
+        with mock.patch.object(transport, "CONNECT_TIMEOUT", 1.0), \
+             mock.patch.object(socket, "create_connection", connect):
+            threads = [threading.Thread(target=call) for _ in range(2)]
+            for t in threads:
+                t.start()
+            time.sleep(0.1)
+            start = time.time()
+            self.assertEqual(e.call("JunkServer.handler2", 2)[0], "handler2-2")
+            self.assertLess(time.time() - start, 0.5)
+            for t in threads:
+                t.join(5)
+        self.assertEqual(result, ["timeout", "timeout"])
+
+class BlobServer:
+    def Echo(self, args):
+        return args
+
+class TestSocketBuffers(unittest.TestCase):
+    def test_socket_buffers(self):
+        rn = SocketNetwork()
+        try:
+            rs = Server()
+            rs.add_service(Service(BlobServer()))
+            rn.add_server("blob", rs)
+            e = rn.make_end("end-blob")
+            rn.connect("end-blob", "blob")
+            rn.enable("end-blob", True)
+
+            big = os.urandom(3 << 20)
+            reply = e.call("BlobServer.Echo", [big, b"small", big[:100]])
+            self.assertEqual(reply, [big, b"small", big[:100]])
+            self.assertEqual(bytes(e.call("BlobServer.Echo", memoryview(big)[5:10])), big[5:10])
+            self.assertEqual(e.call("BlobServer.Echo", "small"), "small")
+        finally:
+            rn.cleanup()
@@ -0,0 +1,70 @@
+import bisect
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+
+# key -> shard placement, shared by KVServer.shard_id and Clerk.getReplicaServers
+# (both get it from cfg.partitioner so they always agree)
+# a shard is the index of its primary server, the replica group is the
+# primary followed by the next nreplicas-1 servers, same as before
+
+def key_hash(key: str) -> int:
+    # stable 64 bit hash, python's hash() is randomized per process so the
+    # clients and servers could disagree on it
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+class StaticPartitioner:
+    # the original static partitioning: int(key) % nshards
+    # non numeric keys used to all go to shard 0, now they are hashed instead
+    def shard(self, key: str, nshards: int) -> int:
+        try:
+            return int(key) % nshards
+        except ValueError:
+            return key_hash(key) % nshards
+
+class ConsistentHashPartitioner:
+    # consistent hashing with virtual nodes (like Dynamo)
+    # every server owns vnodes points on a ring of 64 bit hashes, and a key
+    # goes to the owner of the first point at or after the key's hash
+    # adding a server only moves the keys that land on its new points,
+    # about 1/N of them, instead of almost all of them like with modulo
+    def __init__(self, vnodes: int = 128):
+        self.vnodes = vnodes
+        self.mu = threading.Lock()
+        # nshards -> (sorted point hashes, owner of each point)
+        self.rings: Dict[int, Tuple[List[int], List[int]]] = {}
+
+    def __getstate__(self):
+        # sent to server processes (see cluster.py), locks don't pickle and
+        # the rings are cheap to rebuild
+        return {"vnodes": self.vnodes}
+
+    def __setstate__(self, state):
+        self.__init__(state["vnodes"])
+
+    def ring(self, nshards: int) -> Tuple[List[int], List[int]]:
+        ring = self.rings.get(nshards)
+        if ring is None:
+            with self.mu:
+                ring = self.rings.get(nshards)
+                if ring is None:
+                    ring = self.build_ring(nshards)
+                    self.rings[nshards] = ring
+        return ring
+
+    def build_ring(self, nshards: int) -> Tuple[List[int], List[int]]:
+        # the points of a server only depend on its index, so servers
+        # 0..n-1 have the same points no matter how many servers there are
+        points = []
+        for server in range(nshards):
+            for v in range(self.vnodes):
+                points.append((key_hash(f"server-{server}-vnode-{v}"), server))
+        points.sort()
+        return [p[0] for p in points], [p[1] for p in points]
+
+    def shard(self, key: str, nshards: int) -> int:
+        hashes, owners = self.ring(nshards)
+        i = bisect.bisect_left(hashes, key_hash(key))
+        if i == len(hashes):
+            i = 0 # wrap around the ring
+        return owners[i]
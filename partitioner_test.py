@@ -0,0 +1,40 @@
+import unittest
+
+from partitioner import StaticPartitioner, ConsistentHashPartitioner
+
+class TestStaticPartitioner(unittest.TestCase):
+    def test_numeric(self):
+        p = StaticPartitioner()
+        for i in range(20):
+            self.assertEqual(p.shard(str(i), 3), i % 3)
+
+    def test_strings_spread(self):
+        # non numeric keys should no longer all land on shard 0
+        p = StaticPartitioner()
+        shards = set(p.shard(f"key-{i}", 5) for i in range(100))
+        self.assertEqual(shards, set(range(5)))
+
+class TestConsistentHash(unittest.TestCase):
+    def test_even(self):
+        p = ConsistentHashPartitioner()
+        nshards = 5
+        nkeys = 20000
+        counts = [0] * nshards
+        for i in range(nkeys):
+            counts[p.shard(f"user:{i}", nshards)] += 1
+        for c in counts:
+            self.assertTrue(0.7 * nkeys / nshards < c < 1.3 * nkeys / nshards, f"uneven shards {counts}")
+
+    def test_add_server(self):
+        p = ConsistentHashPartitioner()
+        nkeys = 20000
+        keys = [f"user:{i}" for i in range(nkeys)]
+        before = [p.shard(k, 10) for k in keys]
+        after = [p.shard(k, 11) for k in keys]
+        moved = 0
+        for b, a in zip(before, after):
+            if a != b:
+                # keys only move to the new server
+                self.assertEqual(a, 10)
+                moved += 1
+        self.assertTrue(moved < 1.5 * nkeys / 11, f"{moved} of {nkeys} keys moved")
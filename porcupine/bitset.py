@@ -49,6 +49,10 @@ class BitSet:
             hash_value ^= v
         return hash_value
 
+    def key(self):
+        # hashable copy of the bits, for dict keys
+        return tuple(self.data)
+
     def equals(self, other) -> bool:
         if len(self.data) != len(other.data):
             return False
@@ -57,3 +61,50 @@ class BitSet:
                 return False
         return True
 
+
+class IntBitSet:
+    # same interface as BitSet, but all the bits live in one python int
+    # popcnt is int.bit_count(), hash and equals are the int's own, and
+    # clone doesn't copy anything since ints are immutable
+    # (set/clear make a new int, which is O(bits) like copying the list was,
+    # but it is one C loop instead of a python loop per chunk)
+    __slots__ = ("bits",)
+
+    def __init__(self, bits: int = 0):
+        # bits is only the size, to match BitSet(bits); an int has no fixed size
+        self.bits = 0
+
+    def clone(self):
+        bitset = IntBitSet()
+        bitset.bits = self.bits
+        return bitset
+
+    def set(self, pos: int):
+        self.bits |= 1 << pos
+        return self
+
+    def clear(self, pos: int):
+        self.bits &= ~(1 << pos)
+        return self
+
+    def get(self, pos: int) -> bool:
+        return (self.bits >> pos) & 1 == 1
+
+    def popcnt(self) -> int:
+        return self.bits.bit_count()
+
+    def hash(self) -> int:
+        return hash(self.bits)
+
+    def key(self):
+        return self.bits
+
+    def equals(self, other) -> bool:
+        return self.bits == other.bits
+
+    # so an IntBitSet can be used as (part of) a dict key directly
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __eq__(self, other):
+        return isinstance(other, IntBitSet) and self.bits == other.bits
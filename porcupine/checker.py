@@ -1,9 +1,14 @@
 import threading
 import time
+from collections import OrderedDict
 from typing import List, Tuple, Any, Dict
 
 from porcupine.model import *
-from porcupine.bitset import BitSet
+from porcupine.bitset import IntBitSet
+
+# bitset used for the linearized sets in check_single, BitSet (list of 64 bit
+# chunks, like the go version) or IntBitSet (one int, a lot faster in python)
+DEFAULT_BITSET = IntBitSet
 
 class Entry:
     def __init__(self, is_return: bool, value: Any, id: int, time: int, client_id: int):
@@ -109,16 +114,50 @@ def make_linked_entries(entries: List[Entry]) -> Node:
             root = entry_node
     return root
 
-class CacheEntry:
-    def __init__(self, linearized, state):
-        self.linearized = linearized
-        self.state = state
+class LinearizationCache:
+    # (linearized set, state) pairs check_single has already been in
+    # keyed by (linearized bits, model.fingerprint(state)) so a lookup is one
+    # dict access instead of a scan of every entry with the same bitset hash
+    # a key holds a list of states in case two states that are not equal
+    # share a fingerprint (or the state isn't hashable and the key only has
+    # the bits), that list is almost always one state long
+    #
+    # with max_entries the least recently used keys are evicted once there
+    # are more than that, so memory stays bounded on very long histories
+    # forgetting an entry is always safe, the checker may just explore the
+    # same linearization again
+    def __init__(self, model: Model, max_entries: int = None):
+        self.equal = model.equal
+        self.fingerprint = model.fingerprint
+        self.max_entries = max_entries
+        self.entries = OrderedDict() if max_entries else {}
+
+    def __len__(self):
+        return len(self.entries)
 
-def cache_contains(model: Model, cache: Dict[int, List[CacheEntry]], entry: CacheEntry) -> bool:
-    for elem in cache.get(entry.linearized.hash(), []):
-        if entry.linearized.equals(elem.linearized) and model.Equal(entry.state, elem.state):
+    def add(self, linearized, state) -> bool:
+        # remembers (linearized, state), False if it was already there
+        key = (linearized.key(), self.fingerprint(state))
+        try:
+            states = self.entries.get(key)
+        except TypeError:
+            # unhashable fingerprint
+            key = (key[0], None)
+            states = self.entries.get(key)
+
+        if states is None:
+            self.entries[key] = [state]
+            if self.max_entries and len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
             return True
-    return False
+
+        for s in states:
+            if self.equal(s, state):
+                if self.max_entries:
+                    self.entries.move_to_end(key)
+                return False
+        states.append(state)
+        return True
 
 class CallsEntry:
     def __init__(self, entry: Node, state: Any):
@@ -141,11 +180,11 @@ def unlift(entry: Node):
     entry.prev.next = entry
     entry.next.prev = entry
 
-def check_single(model: Model, history: List[Entry], compute_partial: bool, kill: threading.Event) -> Tuple[bool, List[List[int]]]:
+def check_single(model: Model, history: List[Entry], compute_partial: bool, kill: threading.Event, bitset=DEFAULT_BITSET, cache_size: int = None) -> Tuple[bool, List[List[int]]]:
     entry = make_linked_entries(history)
     n = length(entry) // 2
-    linearized = BitSet(n)
-    cache = {}  # map from hash to cache entry
+    linearized = bitset(n)
+    cache = LinearizationCache(model, cache_size)
     calls = []
     longest = [None] * n  # longest linearizable prefix that includes the given entry
 
@@ -159,12 +198,7 @@ def check_single(model: Model, history: List[Entry], compute_partial: bool, kill
             ok, new_state = model.step(state, entry.value, matching.value)
             if ok:
                 new_linearized = linearized.clone().set(entry.id)
-                new_cache_entry = CacheEntry(new_linearized, new_state)
-                if not cache_contains(model, cache, new_cache_entry):
-                    hash_value = new_linearized.hash()
-                    if hash_value not in cache:
-                        cache[hash_value] = []
-                    cache[hash_value].append(new_cache_entry)
+                if cache.add(new_linearized, new_state):
                     calls.append(CallsEntry(entry, state))
                     state = new_state
                     linearized.set(entry.id)
@@ -206,13 +240,15 @@ def fill_default(model: Model) -> Model:
         model.partition_event = no_partition_event
     if model.equal is None:
         model.equal = shallow_equal
+    if model.fingerprint is None:
+        model.fingerprint = default_fingerprint
     if model.describe_operation is None:
         model.describe_operation = default_describe_operation
     if model.describe_state is None:
         model.describe_state = default_describe_state
     return model
 
-def check_parallel(model: Model, history: List[List[Entry]], compute_info: bool, timeout: float) -> Tuple[str, LinearizationInfo]:
+def check_parallel(model: Model, history: List[List[Entry]], compute_info: bool, timeout: float, bitset=DEFAULT_BITSET, cache_size: int = None) -> Tuple[str, LinearizationInfo]:
     ok = True
     timed_out = False
     results = []
@@ -221,7 +257,7 @@ def check_parallel(model: Model, history: List[List[Entry]], compute_info: bool,
 
     def worker(i: int, subhistory: List[Entry]):
         nonlocal ok
-        single_ok, l = check_single(model, subhistory, compute_info, kill)
+        single_ok, l = check_single(model, subhistory, compute_info, kill, bitset, cache_size)
         longest[i] = l
         results.append(single_ok)
         if not single_ok and not compute_info:
@@ -272,19 +308,19 @@ def check_parallel(model: Model, history: List[List[Entry]], compute_info: bool,
 
     return result, info
 
-def check_events(model: Model, history: List[Event], verbose: bool, timeout: float) -> Tuple[str, LinearizationInfo]:
+def check_events(model: Model, history: List[Event], verbose: bool, timeout: float, bitset=DEFAULT_BITSET, cache_size: int = None) -> Tuple[str, LinearizationInfo]:
     model = fill_default(model)
     partitions = model.partition_event(history)
     l = []
     for i in range(len(partitions)):
         l.append(convert_entries(renumber(partitions[i])))
-    return check_parallel(model, l, verbose, timeout)
+    return check_parallel(model, l, verbose, timeout, bitset, cache_size)
 
-def check_operations(model: Model, history: List[Operation], verbose: bool, timeout: float) -> Tuple[str, LinearizationInfo]:
+def check_operations(model: Model, history: List[Operation], verbose: bool, timeout: float, bitset=DEFAULT_BITSET, cache_size: int = None) -> Tuple[str, LinearizationInfo]:
     model = fill_default(model)
     partitions = model.partition(history)
     l = []
     for i in range(len(partitions)):
         l.append(convert_entries(make_entries(partitions[i])))
-    return check_parallel(model, l, verbose, timeout)
+    return check_parallel(model, l, verbose, timeout, bitset, cache_size)
 
@@ -0,0 +1,85 @@
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from models.kv import KvModel, KvInput, KvOutput
+from porcupine.bitset import BitSet, IntBitSet
+from porcupine.checker import check_single, convert_entries, make_entries, fill_default
+from porcupine.model import Operation
+
+# time to check one long single-key history (what one partition of the
+# KvModel looks like) with the list BitSet vs the int IntBitSet
+# the histories are linearizable, so the checker has to find a full
+# linearization, and the clients overlap so it has to backtrack too
+# then the same with the memo table bounded to a few sizes: time and peak
+# memory of the check
+#
+#   python -m porcupine.checker_bench [nops...]
+
+NCLIENTS = 5
+
+def make_history(nops: int, seed: int = 1):
+    # every client does gets and appends-with-return back to back, each op
+    # takes effect at a random point between its call and its return
+    rand = random.Random(seed)
+    now = [0] * NCLIENTS
+    pending = []
+    for i in range(nops):
+        client = i % NCLIENTS
+        call = now[client] + rand.randint(1, 5)
+        ret = call + rand.randint(1, 20)
+        point = rand.uniform(call, ret)
+        now[client] = ret
+        if rand.random() < 0.3:
+            inp = KvInput(0, "0")
+        else:
+            inp = KvInput(3, "0", f"x{i} ")
+        pending.append((point, client, inp, call, ret))
+
+    state = ""
+    history = []
+    for point, client, inp, call, ret in sorted(pending, key=lambda p: p[0]):
+        out = KvOutput(state)
+        if inp.op == 3:
+            state += inp.value
+        history.append(Operation(client, inp, call, out, ret))
+    return history
+
+def bench(entries, bitset, cache_size=None) -> float:
+    start = time.perf_counter()
+    ok, _ = check_single(KvModel, entries, False, threading.Event(), bitset, cache_size)
+    elapsed = time.perf_counter() - start
+    assert ok
+    return elapsed
+
+def bench_cache(entries, cache_size):
+    # (seconds, peak MiB) with tracing on, so only compare them to each other
+    tracemalloc.start()
+    elapsed = bench(entries, IntBitSet, cache_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+def main():
+    fill_default(KvModel)
+    sizes = [int(a) for a in sys.argv[1:]] or [500, 1000, 2000, 4000]
+    print(f"{'ops':>6} {'BitSet ms':>10} {'IntBitSet ms':>13} {'speedup':>8}")
+    for nops in sizes:
+        entries = convert_entries(make_entries(make_history(nops)))
+        slow = bench(entries, BitSet)
+        fast = bench(entries, IntBitSet)
+        print(f"{nops:>6} {slow * 1e3:>10.1f} {fast * 1e3:>13.1f} {slow / fast:>7.1f}x")
+
+    nops = max(sizes)
+    entries = convert_entries(make_entries(make_history(nops)))
+    print()
+    print(f"{nops} ops, IntBitSet")
+    print(f"{'cache size':>10} {'ms':>8} {'peak MiB':>9}")
+    for cache_size in [None, 100000, 10000, 1000]:
+        elapsed, peak = bench_cache(entries, cache_size)
+        print(f"{str(cache_size or 'unbounded'):>10} {elapsed * 1e3:>8.1f} {peak:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import threading
+import unittest
+
+from models.kv import KvModel, KvInput, KvOutput
+from porcupine.bitset import BitSet, IntBitSet
+from porcupine.checker import check_single, convert_entries, make_entries, fill_default, LinearizationCache
+from porcupine.model import Model, Operation
+
+class TestBitSets(unittest.TestCase):
+    def test_same_answers(self):
+        # IntBitSet has to behave exactly like BitSet
+        a = BitSet(200)
+        b = IntBitSet(200)
+        for pos in [0, 1, 63, 64, 65, 127, 128, 199]:
+            a.set(pos)
+            b.set(pos)
+        a.clear(64)
+        b.clear(64)
+        for pos in range(200):
+            self.assertEqual(a.get(pos), b.get(pos), pos)
+        self.assertEqual(a.popcnt(), 7)
+        self.assertEqual(b.popcnt(), 7)
+
+    def test_clone(self):
+        b = IntBitSet(10).set(3)
+        c = b.clone().set(4)
+        self.assertFalse(b.get(4))
+        self.assertTrue(c.get(4))
+        self.assertFalse(b.equals(c))
+        self.assertTrue(b.equals(c.clear(4)))
+        self.assertEqual(b.hash(), c.hash())
+        # usable as a dict key
+        self.assertEqual({b: 1}[c], 1)
+
+class TestLinearizationCache(unittest.TestCase):
+    def test_add(self):
+        cache = LinearizationCache(fill_default(KvModel))
+        self.assertTrue(cache.add(IntBitSet(8).set(1), "a"))
+        self.assertFalse(cache.add(IntBitSet(8).set(1), "a"))
+        self.assertTrue(cache.add(IntBitSet(8).set(1), "b"))
+        self.assertTrue(cache.add(IntBitSet(8).set(2), "a"))
+        # BitSet works too
+        self.assertTrue(cache.add(BitSet(8).set(1), "a"))
+        self.assertFalse(cache.add(BitSet(8).set(1), "a"))
+
+    def test_unhashable_state(self):
+        cache = LinearizationCache(fill_default(Model()))
+        self.assertTrue(cache.add(IntBitSet(8).set(1), {"k": "a"}))
+        self.assertFalse(cache.add(IntBitSet(8).set(1), {"k": "a"}))
+        self.assertTrue(cache.add(IntBitSet(8).set(1), {"k": "b"}))
+        self.assertFalse(cache.add(IntBitSet(8).set(1), {"k": "b"}))
+
+    def test_fingerprint_collision(self):
+        # equal decides, the fingerprint only picks the slot
+        model = fill_default(Model(fingerprint=lambda state: len(state)))
+        cache = LinearizationCache(model)
+        self.assertTrue(cache.add(IntBitSet(8).set(1), "ab"))
+        self.assertTrue(cache.add(IntBitSet(8).set(1), "cd"))
+        self.assertFalse(cache.add(IntBitSet(8).set(1), "cd"))
+
+    def test_bounded(self):
+        cache = LinearizationCache(fill_default(KvModel), max_entries=3)
+        for i in range(3):
+            cache.add(IntBitSet(8).set(i), "")
+        # touch 0 so 1 is the least recently used one
+        self.assertFalse(cache.add(IntBitSet(8).set(0), ""))
+        cache.add(IntBitSet(8).set(3), "")
+        self.assertEqual(len(cache), 3)
+        self.assertFalse(cache.add(IntBitSet(8).set(0), ""))
+        self.assertTrue(cache.add(IntBitSet(8).set(1), ""))
+
+def check(history, bitset, cache_size=None):
+    entries = convert_entries(make_entries(history))
+    ok, _ = check_single(fill_default(KvModel), entries, False, threading.Event(), bitset, cache_size)
+    return ok
+
+class TestCheckSingle(unittest.TestCase):
+    def history(self, second_get):
+        # append a and append b overlap, so either order is fine
+        return [
+            Operation(0, KvInput(2, "0", "a"), 0, KvOutput(), 10),
+            Operation(1, KvInput(2, "0", "b"), 1, KvOutput(), 11),
+            Operation(0, KvInput(0, "0"), 12, KvOutput("ba"), 13),
+            Operation(1, KvInput(0, "0"), 14, KvOutput(second_get), 15),
+        ]
+
+    def test_linearizable(self):
+        for bitset in [BitSet, IntBitSet]:
+            self.assertTrue(check(self.history("ba"), bitset), bitset)
+
+    def test_not_linearizable(self):
+        for bitset in [BitSet, IntBitSet]:
+            self.assertFalse(check(self.history("ab"), bitset), bitset)
+
+    def test_small_cache(self):
+        # evicting entries must not change the answer
+        self.assertTrue(check(self.history("ba"), IntBitSet, 1))
+        self.assertFalse(check(self.history("ab"), IntBitSet, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,6 +23,7 @@ class Model:
                        init: Callable[[], Any] = None,
                        step: Callable[[Any, Any, Any], Tuple[bool, Any]] = None,
                        equal: Callable[[Any, Any], bool] = None,
+                       fingerprint: Callable[[Any], Any] = None,
                        describe_operation: Callable[[Any, Any], str] = None,
                        describe_state: Callable[[Any], str] = None):
         # Partition functions, such that a history is linearizable if and only
@@ -40,6 +41,11 @@ class Model:
         # Equality on states. If you are using a simple data type for states,
         # you can use the `shallow_equal` function implemented below.
         self.equal = equal
+        # Hashable summary of a state, used to look states up in the
+        # checker's cache. States that are equal must have the same
+        # fingerprint. The default is the state itself; unhashable states
+        # still work, they just fall back to comparing with `equal`.
+        self.fingerprint = fingerprint
         # For visualization, describe an operation as a string.
         # For example, "Get('x') -> 'y'".
         self.describe_operation = describe_operation
@@ -56,6 +62,9 @@ def no_partition_event(history: List[Event]) -> List[List[Event]]:
 def shallow_equal(state1: Any, state2: Any) -> bool:
     return state1 == state2
 
+def default_fingerprint(state: Any) -> Any:
+    return state
+
 def default_describe_operation(input: Any, output: Any) -> str:
     return f"{input} -> {output}"
 
@@ -1,9 +1,22 @@
 import logging
 import threading
+from contextlib import contextmanager
 from typing import Tuple, Any
 
+from kvstore import KVStore, EMPTY
+from labgob import labgob
+from dedup import DedupTable
+
 debugging = False
 
+# number of lock stripes per server, config.nstripes overrides it
+DEFAULT_STRIPES = 16
+
+# role of a server for a shard
+NOT_REPLICA = 0
+BACKUP = 1
+PRIMARY = 2
+
 # Use this function for debugging
 def debug(format, *args):
     if debugging:
@@ -12,12 +25,13 @@ def debug(format, *args):
 # Put or Append
 class PutAppendArgs:
     # Add definitions here if needed
-    def __init__(self, key, value, client_id, request_id):
+    def __init__(self, key, value, client_id, request_id, ack=0):
         self.key = key
         self.value = value
         # new stuff ----------------
         self.client_id = client_id 
         self.request_id = request_id # used to differentiate operations
+        self.ack = ack # every request id below this one is done on the client
 
 class PutAppendReply:
     # Add definitions here if needed 
@@ -37,16 +51,95 @@ class GetReply:
         # added var for error messaging
         self.err = err
 
+# compact encoding for the messages of every single-key RPC (see labgob.register)
+# the ids have to stay the same for servers and clerks in other processes
+labgob.register(GetArgs, 1, [("key", str)])
+labgob.register(GetReply, 2, [("value", str), ("err", str)])
+labgob.register(PutAppendArgs, 3, [("key", str), ("value", str), ("client_id", int), ("request_id", int), ("ack", int)])
+labgob.register(PutAppendReply, 4, [("value", str), ("err", str)])
+
+# batched versions, all keys of a batch belong to the same shard
+class MultiGetArgs:
+    def __init__(self, keys):
+        self.keys = keys
+
+class MultiGetReply:
+    def __init__(self, values=None, err=""):
+        self.values = values if values is not None else []
+        self.err = err
+
+class MultiPutAppendArgs:
+    def __init__(self, keys, values, client_id, request_id, ack=0):
+        self.keys = keys
+        self.values = values
+        # the whole batch is one request for duplicate detection
+        self.client_id = client_id
+        self.request_id = request_id
+        self.ack = ack
+
+class MultiPutAppendReply:
+    def __init__(self, values=None, err=""):
+        self.values = values if values is not None else [] # old values for MultiAppend
+        self.err = err
+
 class KVServer:
-    def __init__(self, cfg):
-        self.mu = threading.Lock()
+    # the methods labrpc.Service exposes, everything else is internal
+    rpc_methods = ["Get", "Put", "Append", "MultiGet", "MultiPut", "MultiAppend"]
+
+    def __init__(self, cfg, me=None):
         self.cfg = cfg
 
-        # dict used for key value pairs
+        # index of this server in cfg.kvservers, looked up on first use if not given
+        self.me = me
+        # filled in by build_routing() on the first request
+        self.routing_table = (None, [], [])
+
+        # key value pairs, values are kept as chunk lists (see kvstore.py)
         # prof recommended to use this instead of doing Paxos or 2 phase commit
-        self.kv_store = {}
+        self.kv_store = KVStore()
+
+        # lock striping: writes to a key take the lock of its stripe, so writes
+        # to unrelated keys don't wait on each other
+        # reads don't take any lock, they only grab an O(1) snapshot of the value
+        self.nstripes = getattr(cfg, "nstripes", DEFAULT_STRIPES)
+        self.stripes = [threading.Lock() for _ in range(self.nstripes)]
         
-        self.processed_requests = {}
+        # per client window of results for duplicate requests (see dedup.py)
+        # idle clients are timed out on the network's clock, which is
+        # simulated time when the network is simulated
+        # striped by client id like the keys, each table with its own lock,
+        # so writes from different clients don't wait on one dedup lock
+        net = getattr(cfg, "net", None)
+        clock = getattr(net, "clock", None)
+        self.processed_requests = [DedupTable(clock=clock.now) if clock is not None else DedupTable()
+                                   for _ in range(self.nstripes)]
+        self.dedup_locks = [threading.Lock() for _ in range(self.nstripes)]
+
+    def stripe_lock(self, key: str) -> threading.Lock:
+        return self.stripes[hash(key) % self.nstripes]
+
+    @contextmanager
+    def stripe_locks(self, keys):
+        # locks every stripe used by keys, always in the same order so two
+        # batches can't deadlock on each other
+        stripes = sorted(set(hash(key) % self.nstripes for key in keys))
+        for i in stripes:
+            self.stripes[i].acquire()
+        try:
+            yield
+        finally:
+            for i in reversed(stripes):
+                self.stripes[i].release()
+
+    def lookup_duplicate(self, args: PutAppendArgs):
+        i = args.client_id % self.nstripes
+        with self.dedup_locks[i]:
+            return self.processed_requests[i].lookup(args.client_id, args.request_id, args.ack)
+
+    def record_result(self, args: PutAppendArgs, result):
+        i = args.client_id % self.nstripes
+        with self.dedup_locks[i]:
+            self.processed_requests[i].record(args.client_id, args.request_id, result)
 
 
     # SHARDING and REPLICA LOGIC
@@ -55,53 +148,66 @@ class KVServer:
 
     def shard_id(self, key:str):
         # determine shard assignment based on key
-        # prof said to hash key using int(key) % shards
-        try:
-            return int(key) %  self.cfg.nservers
-        except ValueError: # if not numeric
-            return 0 # default to shard 0
-    
+        # the partitioner is shared with the clerks through the config
+        # (static int(key) % shards by default, see partitioner.py)
+        return self.cfg.partitioner.shard(key, self.cfg.nservers)
+
+    def routing(self):
+        # (config key, replica groups, role of this server for every shard)
+        # built once and rebuilt only when nservers or nreplicas change, so the
+        # checks below are a list index instead of a scan of cfg.kvservers
+        table = self.routing_table
+        if table[0] != (self.cfg.nservers, self.cfg.nreplicas):
+            table = self.build_routing()
+        return table
+
+    def build_routing(self):
+        nservers = self.cfg.nservers
+        nreplicas = self.cfg.nreplicas
+
+        if self.me is None:
+            # not given by the config, find our own index once
+            self.me = self.cfg.kvservers.index(self)
+
+        groups = []
+        roles = []
+        for shard in range(nservers):
+            # the first one is the primary, and the rest are simply backups
+            group = [(shard + i) % nservers for i in range(nreplicas)]
+            groups.append(group)
+            if group[0] == self.me:
+                roles.append(PRIMARY)
+            elif self.me in group:
+                roles.append(BACKUP)
+            else:
+                roles.append(NOT_REPLICA)
+
+        # one tuple assignment, so concurrent requests never see half a table
+        self.routing_table = ((nservers, nreplicas), groups, roles)
+        return self.routing_table
+
     def getReplicaGroup(self , shard: int) -> list[int]:
         # return list of servers for this particular shard
-        # the first one is the primary, and the rest are simply backups
-        replicas = []
-
-        for i in range( 0, self.cfg.nreplicas ):
-            serverIndex = ( shard+i) % self.cfg.nservers
-            replicas.append(serverIndex)
-
-        return replicas
+        # the list is shared, callers must not modify it
+        return self.routing()[1][shard]
     
     def is_replica(self, shard:int):
         # this is used to check if the server is a replica
         # given the shard
-
-        # first get the list of server indeces
-        replica_servers = self.getReplicaGroup(shard)
-
-        # then find the index in relation to the other servers
-        my_index = self.cfg.kvservers.index(self)
-
-        # finally check if the server is a replica for the shard
-        if my_index in replica_servers:
-            return True
-        else:
-            return False
+        return self.routing()[2][shard] != NOT_REPLICA
 
     def is_primary(self, shard: int):
         # primary replica is the first server in the overall replica group of the given shard
         # based on profs guidance, where index == shard is the primary
-        primaryServerIndex = shard 
-
-        myServerIndex = self.cfg.kvservers.index(self) 
-
-        return myServerIndex == primaryServerIndex # returns true if is is the primary
+        return self.routing()[2][shard] == PRIMARY
 
     # forward definition
-    def forward(self, op:str, args:Any) -> Any:
+    def forward(self, op:str, args:Any, shard:int=None) -> Any:
         # forward operation to primary replica
         # prof mentioned in class, that the primary (aka leader) gets to make updates
-        primary = self.cfg.kvservers[self.shard_id(args.key)]
+        if shard is None:
+            shard = self.shard_id(args.key)
+        primary = self.cfg.kvservers[shard]
 
         fn = getattr(primary, op)
         return fn(args)
@@ -122,9 +228,11 @@ class KVServer:
             return self.forward("Get", args)
         
         # can properly handle request as a primary
-        with self.mu:
-            value= self.kv_store.get(args.key, "")
-            return GetReply(value=value)
+        # no lock needed, taking the snapshot is a single dict lookup
+        value = self.kv_store.get(args.key)
+
+        # joining the chunks is done outside the lock
+        return GetReply(value=value.materialize())
 
     def Put(self, args: PutAppendArgs):
         # newer shard logic
@@ -140,16 +248,17 @@ class KVServer:
             return self.forward("Put", args)
 
         # if primary, process write requuest
-        with self.mu:
-            req_key = (args.client_id, args.request_id)
-
+        # retries of a request always use the same key, so the stripe lock
+        # also keeps two copies of one request from both getting applied
+        with self.stripe_lock(args.key):
             # handle duplicate requests
-            if req_key in self.processed_requests:
-                return PutAppendReply( value=self.processed_requests[req_key] )
+            seen, _ = self.lookup_duplicate(args)
+            if seen:
+                return PutAppendReply()
             
             
-            self.kv_store[args.key] = args.value
-            self.processed_requests[req_key] = ""  # empty string for Put
+            self.kv_store.put(args.key, args.value)
+            self.record_result(args, EMPTY)  # empty string for Put
 
             return PutAppendReply()
         
@@ -167,20 +276,81 @@ class KVServer:
             return self.forward("Append", args)
 
         # if primary then it can be processed
-        with self.mu:
-            req_key = (args.client_id, args.request_id)
-
+        with self.stripe_lock(args.key):
             # handle duplicate requests similar to put
-            if req_key in self.processed_requests:
-                return PutAppendReply(value = self.processed_requests[req_key])
-            
-            old_value = self.kv_store.get(args.key, "")
-            self.kv_store[args.key] = old_value + args.value
+            seen, old_value = self.lookup_duplicate(args)
+            if seen:
+                if old_value is None: # client already moved past this one
+                    old_value = EMPTY
+            else:
+                # O(1), the old value is only a snapshot of the chunk list
+                old_value = self.kv_store.append(args.key, args.value)
+
+                # save the original value instead
+                self.record_result(args, old_value)
+
+        # build the old value string without holding the lock
+        # (a full copy of the value, the reply has to carry all of it anyway)
+        return PutAppendReply(old_value.materialize())
+
+    # BATCHED REQUEST HANDLERS #---------------------------------------
+
+    def batch_shard(self, keys) -> int:
+        # shard of the batch, or -1 if the keys don't all belong to one shard
+        shard = self.shard_id(keys[0])
+        for key in keys[1:]:
+            if self.shard_id(key) != shard:
+                return -1
+        return shard
+
+    def MultiGet(self, args: MultiGetArgs):
+        if not args.keys:
+            return MultiGetReply()
+        shard = self.batch_shard(args.keys)
+
+        if shard < 0 or not self.is_replica(shard):
+            return MultiGetReply(err="WRONG_SHARD")
+
+        if not self.is_primary(shard):
+            return self.forward("MultiGet", args, shard)
+
+        # same as Get, snapshots without a lock and join them afterwards
+        snapshots = [self.kv_store.get(key) for key in args.keys]
+        return MultiGetReply(values=[v.materialize() for v in snapshots])
 
-            # save the original value instead
-            self.processed_requests[req_key] = old_value
+    def multi_put_append(self, op: str, args: MultiPutAppendArgs):
+        if not args.keys:
+            return MultiPutAppendReply()
+        shard = self.batch_shard(args.keys)
 
-            return PutAppendReply(old_value)
+        if shard < 0 or not self.is_replica(shard):
+            return MultiPutAppendReply(err="WRONG_SHARD")
+
+        if not self.is_primary(shard):
+            return self.forward(op, args, shard)
+
+        # the whole batch is applied while holding its stripe locks once
+        with self.stripe_locks(args.keys):
+            seen, old_values = self.lookup_duplicate(args)
+            if seen:
+                if old_values is None: # client already moved past this one
+                    old_values = [EMPTY] * len(args.keys)
+            elif op == "MultiPut":
+                for key, value in zip(args.keys, args.values):
+                    self.kv_store.put(key, value)
+                old_values = [EMPTY] * len(args.keys)
+                self.record_result(args, old_values)
+            else:
+                old_values = [self.kv_store.append(key, value) for key, value in zip(args.keys, args.values)]
+                self.record_result(args, old_values)
+
+        return MultiPutAppendReply(values=[v.materialize() for v in old_values])
+
+    def MultiPut(self, args: MultiPutAppendArgs):
+        return self.multi_put_append("MultiPut", args)
+
+    def MultiAppend(self, args: MultiPutAppendArgs):
+        return self.multi_put_append("MultiAppend", args)
 
     
 # REFERENCES AND AI ACKNOWLEDGEMENT
@@ -0,0 +1,61 @@
+import random
+import threading
+import time
+
+from config import make_shard_config
+
+# contention benchmark for KVServer locking
+# runs nclients clerks against a sharded cluster doing puts/appends/gets on
+# random keys and reports the throughput, once with a single lock stripe
+# (the old one-lock-per-server behavior) and once with the default stripes
+#
+#   python server_bench.py
+
+NSHARDS = 3
+NREPLICAS = 1
+DURATION = 2  # seconds per run
+NKEYS = 100
+
+def run(nclients: int, nstripes: int) -> float:
+    cfg = make_shard_config(None, NSHARDS, NREPLICAS, False, nstripes=nstripes)
+    try:
+        clerks = [cfg.make_client() for _ in range(nclients)]
+        done = threading.Event()
+        counts = [0] * nclients
+
+        def client(i):
+            ck = clerks[i]
+            n = 0
+            while not done.is_set():
+                key = str(random.randint(0, NKEYS - 1))
+                r = random.random()
+                if r < 0.25:
+                    ck.put(key, "x")
+                elif r < 0.5:
+                    ck.append(key, "y")
+                else:
+                    ck.get(key)
+                n += 1
+            counts[i] = n
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(nclients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(DURATION)
+        done.set()
+        for t in threads:
+            t.join()
+        return sum(counts) / (time.perf_counter() - start)
+    finally:
+        cfg.cleanup()
+
+def main():
+    print(f"{'clients':>8} {'1 stripe ops/s':>16} {'16 stripes ops/s':>18}")
+    for nclients in [1, 2, 4, 8, 16, 32]:
+        single = run(nclients, 1)
+        striped = run(nclients, 16)
+        print(f"{nclients:>8} {single:>16.0f} {striped:>18.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 import random
@@ -12,6 +13,8 @@ from porcupine.model import Operation
 from porcupine.porcupine import check_operations_verbose
 from models.kv import KvInput, KvOutput, KvModel
 from config import make_single_config, make_shard_config, Config
+from labrpc.labrpc import Simulator
+from client import RetryPolicy, ClerkTimeoutError
 
 linearizability_check_timeout = 1  # in seconds
 MiB = 1024 * 1024
@@ -430,3 +433,301 @@ class TestRejection(unittest.TestCase):
 class TestUnreliableShards(unittest.TestCase):
     def test_unreliable_shards(self):
         generic_test(self, 5, (5, 3), True, False)
+
+# batched multi_get/multi_put/multi_append over several shards
+class TestMultiKey(unittest.TestCase):
+    def test_multi_key(self):
+        for unreliable in [False, True]:
+            cfg = make_shard_config(self, 3, 2, unreliable)
+            try:
+                ck = cfg.make_client()
+
+                n = 20
+                ka = [str(i) for i in range(n)]
+                va = [randstring(20) for i in range(n)]
+                ck.multi_put(ka, va)
+                for i in range(n):
+                    check(self, ck, ka[i], va[i])
+                self.assertEqual(ck.multi_get(ka), va)
+
+                # the same key twice in one batch is appended in order
+                keys = ka + ["0"]
+                vals = [f"x {i} y" for i in range(n)] + ["z"]
+                old = ck.multi_append(keys, vals)
+                self.assertEqual(old, va + [va[0] + "x 0 y"])
+                check(self, ck, "0", va[0] + "x 0 yz")
+                check(self, ck, "7", va[7] + "x 7 y")
+            finally:
+                cfg.cleanup()
+
+# once the primary of a shard is down, clerks should go straight to the
+# backup that answered instead of trying the dead primary every time
+class TestRoutingCache(unittest.TestCase):
+    def test_routing_cache(self):
+        cfg = make_shard_config(self, 3, 2, False)
+        try:
+            ck = cfg.make_client()
+            ck.put("0", "a")
+
+            cfg.stop_server(0)
+            ck.append("0", "b") # finds out server 0 is down
+
+            rpcs0 = cfg.rpc_total()
+            for i in range(10):
+                check(self, ck, "0", "ab")
+            nrpc = cfg.rpc_total() - rpcs0
+            self.assertEqual(nrpc, 10, f"expected one RPC per get, got {nrpc}")
+
+            cfg.start_server(0)
+        finally:
+            cfg.cleanup()
+
+# with a deadline, an operation on a dead shard should give up with a
+# timeout error instead of retrying forever
+class TestRetryDeadline(unittest.TestCase):
+    def test_retry_deadline(self):
+        cfg = make_shard_config(self, 3, 1, False)
+        try:
+            cfg.retry_policy = RetryPolicy(deadline=0.5)
+            ck = cfg.make_client()
+            ck.put("0", "a")
+            check(self, ck, "0", "a")
+
+            cfg.stop_server(0)
+            start = time.time()
+            with self.assertRaises(ClerkTimeoutError):
+                ck.get("0")
+            self.assertLess(time.time() - start, 1.0)
+            # other shards still work
+            ck.put("1", "b")
+            check(self, ck, "1", "b")
+
+            stats = ck.stats.snapshot()
+            self.assertEqual(stats["timeouts"], 1)
+            self.assertGreater(stats["retries"], 0)
+
+            cfg.start_server(0)
+            check(self, ck, "0", "a")
+        finally:
+            cfg.cleanup()
+
+    def test_deadline_cuts_off_calls(self):
+        # a call to a stopped server can take seconds with long delays, the
+        # deadline has to interrupt it rather than wait for it to fail
+        cfg = make_shard_config(self, 3, 1, False)
+        try:
+            cfg.net.long_delays(True)
+            cfg.retry_policy = RetryPolicy(deadline=0.5)
+            ck = cfg.make_client()
+            cfg.stop_server(0)
+            start = time.time()
+            with self.assertRaises(ClerkTimeoutError):
+                ck.get("0")
+            self.assertLess(time.time() - start, 1.0)
+        finally:
+            cfg.cleanup()
+
+    def test_batch_timeout(self):
+        # a batch that spans shards must raise if one of its shards timed
+        # out, not return with that shard's part missing
+        cfg = make_shard_config(self, 3, 1, False)
+        try:
+            cfg.retry_policy = RetryPolicy(deadline=0.3)
+            ck = cfg.make_client()
+            ck.multi_put(["0", "1", "2"], ["a", "b", "c"])
+
+            cfg.stop_server(0)
+            with self.assertRaises(ClerkTimeoutError):
+                ck.multi_get(["0", "1", "2"])
+            with self.assertRaises(ClerkTimeoutError):
+                ck.multi_append(["0", "1"], ["x", "y"])
+
+            cfg.start_server(0)
+            self.assertEqual(ck.multi_get(["0", "1", "2"]), ["a", "by", "c"])
+        finally:
+            cfg.cleanup()
+
+# hedged gets must still return the right values on an unreliable network
+class TestHedgedReads(unittest.TestCase):
+    def test_hedged_reads(self):
+        cfg = make_shard_config(self, 3, 3, True)
+        try:
+            cfg.hedged_reads = True
+            ck = cfg.make_client()
+
+            n = 10
+            ka = [str(i) for i in range(n)]
+            va = [randstring(20) for i in range(n)]
+            for i in range(n):
+                ck.put(ka[i], va[i])
+            for _ in range(5):
+                for i in range(n):
+                    check(self, ck, ka[i], va[i])
+        finally:
+            cfg.cleanup()
+
+    def test_hedged_deadline(self):
+        # hedged gets follow the retry policy like any other call
+        cfg = make_shard_config(self, 3, 2, False)
+        try:
+            cfg.hedged_reads = True
+            cfg.retry_policy = RetryPolicy(deadline=0.5)
+            ck = cfg.make_client()
+            cfg.net.long_delays(True)
+            cfg.stop_server(0)
+            cfg.stop_server(1)
+            start = time.time()
+            with self.assertRaises(ClerkTimeoutError):
+                ck.get("0")
+            self.assertLess(time.time() - start, 1.0)
+            self.assertEqual(ck.stats.snapshot()["timeouts"], 1)
+        finally:
+            cfg.cleanup()
+
+# one AsyncClerk with many appends in flight at once, on several keys
+# appends to the same key must be applied in the order they were issued
+class TestAsyncClerk(unittest.TestCase):
+    def test_async_clerk(self):
+        cfg = make_shard_config(self, 3, 2, True)
+        try:
+            ack = cfg.make_async_client()
+            ck = cfg.make_client()
+
+            nkeys = 5
+            upto = 20
+
+            async def run():
+                ops = []
+                for j in range(upto):
+                    for k in range(nkeys):
+                        ops.append(ack.append(str(k), f"x {k} {j} y"))
+                return await asyncio.gather(*ops)
+
+            olds = asyncio.run(run())
+
+            for k in range(nkeys):
+                v = get(cfg, ck, str(k), None, -1)
+                check_clnt_appends(self, k, v, upto)
+            # every append saw exactly the appends issued before it
+            for i, old in enumerate(olds):
+                j, k = divmod(i, nkeys)
+                self.assertEqual(old, "".join(f"x {k} {n} y" for n in range(j)))
+        finally:
+            cfg.cleanup()
+
+# a whole unreliable cluster in simulated time: same seed, same run
+class TestSimulatedCluster(unittest.TestCase):
+    def run_sim(self, seed):
+        sim = Simulator(seed)
+        cfg = make_shard_config(self, 3, 2, True, sim=sim)
+        try:
+            cfg.net.long_reordering(True)
+            ck = cfg.make_client()
+            nkeys = 5
+            upto = 30
+            for j in range(upto):
+                for k in range(nkeys):
+                    ck.append(str(k), f"x {k} {j} y")
+                if j == 10:
+                    cfg.stop_server(1)
+                if j == 20:
+                    cfg.start_server(1)
+            for k in range(nkeys):
+                check_clnt_appends(self, k, ck.get(str(k)), upto)
+            return sim.now(), sim.events, ck.stats.snapshot()
+        finally:
+            cfg.cleanup()
+
+    def test_simulated_cluster(self):
+        start = time.time()
+        a = self.run_sim(3)
+        self.assertEqual(a, self.run_sim(3))
+        self.assertNotEqual(a, self.run_sim(4))
+        self.assertGreater(a[2]["retries"], 0)
+        self.assertLess(time.time() - start, 10)
+
+# the same cluster over real TCP connections on 127.0.0.1
+class TestTcpCluster(unittest.TestCase):
+    def test_tcp_cluster(self):
+        cfg = make_shard_config(self, 3, 2, False, tcp=True)
+        try:
+            nkeys = 5
+            upto = 20
+
+            def fn(cli, ck, t):
+                for j in range(upto):
+                    ck.append(str(cli), f"x {cli} {j} y")
+
+            spawn_clients_and_wait(self, cfg, nkeys, fn)
+            ck = cfg.make_client()
+            for k in range(nkeys):
+                check_clnt_appends(self, k, ck.get(str(k)), upto)
+
+            # a stopped server's backup takes over
+            cfg.stop_server(0)
+            ck.put("0", "a")
+            check(self, ck, "0", "a")
+            cfg.start_server(0)
+            check(self, ck, "6", "")
+            self.assertGreater(cfg.rpc_total(), nkeys * upto)
+        finally:
+            cfg.cleanup()
+
+    def test_tcp_unreliable(self):
+        # not supported, refused before anything is started
+        with self.assertRaises(ValueError):
+            make_shard_config(self, 3, 2, True, tcp=True)
+
+# every server in its own process, backups forward to primaries over TCP
+class TestProcessCluster(unittest.TestCase):
+    def test_process_cluster(self):
+        cfg = make_shard_config(self, 3, 2, False, processes=True)
+        try:
+            nkeys = 5
+            upto = 20
+
+            def fn(cli, ck, t):
+                for j in range(upto):
+                    ck.append(str(cli), f"x {cli} {j} y")
+
+            spawn_clients_and_wait(self, cfg, nkeys, fn)
+            ck = cfg.make_client()
+            for k in range(nkeys):
+                check_clnt_appends(self, k, ck.get(str(k)), upto)
+
+            # clients can't reach the primary, the backup forwards for them
+            cfg.stop_server(0)
+            ck.append("0", "z")
+            check(self, ck, "0", "".join(f"x 0 {j} y" for j in range(upto)) + "z")
+            cfg.start_server(0)
+            check(self, ck, "3", "".join(f"x 3 {j} y" for j in range(upto)))
+        finally:
+            cfg.cleanup()
+
+# big binary values go from the clerk into kv_store without being copied
+class TestLargeValues(unittest.TestCase):
+    def test_large_values(self):
+        for tcp in [False, True]:
+            cfg = make_shard_config(self, 3, 2, False, tcp=tcp)
+            try:
+                ck = cfg.make_client()
+                big = os.urandom(2 << 20)
+                ck.put("1", big)
+                self.assertEqual(ck.get("1"), big)
+                if not tcp:
+                    self.assertIs(cfg.kvservers[1].kv_store.data["1"].chunks[0], big)
+
+                more = os.urandom(1 << 20)
+                self.assertEqual(ck.append("1", more), big)
+                self.assertEqual(ck.get("1"), big + more)
+
+                # mutable buffers are copied on the way, so changing them
+                # afterwards doesn't change the stored value
+                buf = bytearray(big)
+                ck.put("2", buf)
+                buf[:5] = b"XXXXX"
+                self.assertEqual(ck.get("2"), big)
+                ck.append("2", memoryview(more))
+                self.assertEqual(ck.get("2"), big + more)
+            finally:
+                cfg.cleanup()
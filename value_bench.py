@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+
+from config import make_shard_config
+from labgob import labgob
+
+# put + get of big binary values, with big values sent out of band (the
+# default) and copied into the pickle like before (threshold raised so
+# nothing goes out of band), on the in-memory network and over TCP
+#
+#   python value_bench.py [max MB]
+
+def run(size: int, tcp: bool, rounds: int = 3) -> float:
+    cfg = make_shard_config(None, 1, 1, False, tcp=tcp)
+    try:
+        ck = cfg.make_client()
+        value = os.urandom(size)
+        start = time.perf_counter()
+        for i in range(rounds):
+            ck.put("1", value)
+            ck.get("1")
+        return (time.perf_counter() - start) / rounds
+    finally:
+        cfg.cleanup()
+
+def main():
+    maxmb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    labgob.set_production(True)
+    default = labgob.OOB_THRESHOLD
+    print(f"{'MB':>4} {'network':>8} {'in-band ms':>11} {'out-of-band ms':>15}")
+    mb = 1
+    while mb <= maxmb:
+        for tcp in [False, True]:
+            results = []
+            for threshold in [1 << 62, default]:
+                labgob.OOB_THRESHOLD = threshold
+                results.append(run(mb << 20, tcp))
+            labgob.OOB_THRESHOLD = default
+            print(f"{mb:>4} {'tcp' if tcp else 'memory':>8} {results[0] * 1000:>11.1f} {results[1] * 1000:>15.1f}")
+        mb *= 4
+
+if __name__ == "__main__":
+    main()